@@ -6,27 +6,58 @@ Uses OpenAI Realtime API with correct 2025 patterns
 import os
 import logging
 from typing import Dict, Any
-from datetime import datetime, date
-import json
+from datetime import datetime, date, timezone
 import asyncio
+import functools
+import heapq
+import itertools
 import re
 
 from dotenv import load_dotenv
 from livekit.agents import (
     Agent, AgentSession, JobContext, RunContext,
     WorkerOptions, cli, function_tool, JobProcess, AutoSubscribe,
-    io, RoomInputOptions
+    io, RoomInputOptions, metrics, ModelSettings, stt
 )
+from livekit.agents.utils.aio import cancel_and_wait
 from livekit.plugins import openai, silero, deepgram, cartesia
 from livekit import rtc
 import aiohttp
 import asyncio
 import numpy as np
 import time
-from typing import Dict, Optional
+from typing import AsyncIterable, AsyncIterator, Dict, NamedTuple, Optional
+
+try:
+    import orjson
+    from orjson import loads as json_loads
+
+    # datetimes are serialized natively (naive values are tagged as UTC)
+    json_dumps = functools.partial(orjson.dumps, option=orjson.OPT_NAIVE_UTC)
+except ImportError:  # orjson is optional - fall back to the stdlib encoder
+    import json
+
+    def _json_default(obj: Any) -> str:
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_json_default).encode('utf-8')
+
+    json_loads = json.loads
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (no Windows support) - keep the default loop
+    uvloop = None
+else:
+    # Installed at import time: job processes import this module before
+    # creating their event loop, so they run on uvloop too
+    uvloop.install()
 
 # Import our audio utilities
-from audio_utils import resample_audio, create_audio_frame_48khz, generate_test_tone, AudioFrameBuffer
+from audio_utils import create_audio_frame_48khz, generate_test_tone, AudioFrameBuffer
 
 # Import language configuration
 from language_config import get_deepgram_config, log_language_configuration, get_language_name, get_greeting, get_welcome_back_message
@@ -42,30 +73,225 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Markdown tokens handled by strip_markdown (runs on every TTS utterance).
+# The lookahead lets the scanner skip plain text quickly; text between matches
+# is copied through untouched.
+_MD_TOKEN = re.compile(r'(?=[*#`\[\]h])(?:```|[`\[\]]|\*+|#+|https?://\S+)')
+_MD_MARKERS = ('*', '#', '`', '[', ']', '://')
+
+
 def strip_markdown(text: str) -> str:
-    """Remove all markdown formatting from text for TTS"""
-    # Remove bold/italic markers
-    text = re.sub(r'\*+([^*]+)\*+', r'\1', text)
-    # Remove headers
-    text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
-    # Remove links [text](url)
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
-    # Remove bare URLs
-    text = re.sub(r'https?://[^\s]+', '', text)
-    # Remove any remaining brackets
-    text = text.replace('[', '').replace(']', '')
-    # Remove code blocks
-    text = re.sub(r'```[^```]+```', '', text, flags=re.DOTALL)
-    text = re.sub(r'`([^`]+)`', r'\1', text)
-    return text.strip()
+    """Remove all markdown formatting from text for TTS
+
+    Single left-to-right scan: emphasis markers, header prefixes, link targets,
+    bare URLs, code fences and brackets are dropped as they are encountered, so
+    the text is copied once instead of once per pattern.
+    """
+    # Most replies are plain prose: skip the scan when no marker can match
+    if not any(marker in text for marker in _MD_MARKERS):
+        return text.strip()
+    out = []
+    append = out.append
+    search = _MD_TOKEN.search
+    n = len(text)
+    pos = 0  # start of text not yet copied to out
+    in_emphasis = False
+    in_link_text = False
+    m = search(text)
+    while m is not None:
+        i, j = m.span()
+        c = text[i]
+        if c == '*':
+            # Bold/italic marker: only dropped when it opens or closes a span
+            if not (in_emphasis or (j < n and text.find('*', j) != -1)):
+                m = search(text, j)
+                continue
+            in_emphasis = not in_emphasis
+            append(text[pos:i])
+            pos = j
+        elif c == '#':
+            # Header marker at the start of a line, with the whitespace after it
+            if not ((i == 0 or text[i - 1] == '\n') and j < n and text[j].isspace()):
+                m = search(text, j)
+                continue
+            append(text[pos:i])
+            while j < n and text[j].isspace():
+                j += 1
+            pos = j
+        elif c == '`':
+            end = text.find(text[i:j], j)
+            if end == -1 or (j - i == 1 and end == j):
+                m = search(text, j)
+                continue
+            append(text[pos:i])
+            if j - i == 1:
+                # Inline code: keep the content, drop the backticks
+                append(text[j:end])
+            # Fenced code blocks are dropped entirely
+            j = pos = end + (j - i)
+        elif c == '[':
+            in_link_text = True
+            append(text[pos:i])
+            pos = j
+        elif c == ']':
+            append(text[pos:i])
+            if in_link_text and text.startswith('(', j):
+                end = text.find(')', j + 1)
+                if end > j + 1:
+                    # Drop the (url) part of [text](url)
+                    j = end + 1
+            in_link_text = False
+            pos = j
+        else:
+            # Bare URL
+            append(text[pos:i])
+            pos = j
+        m = search(text, j)
+    append(text[pos:])
+    return ''.join(out).strip()
+
+# Sentence boundary for streamed TTS: terminal punctuation followed by whitespace.
+# Decimal numbers ("4.5") never match since there is no whitespace after the dot.
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_ABBREVIATIONS = ('Dr.', 'Mr.', 'Mrs.', 'Ms.', 'St.', 'vs.', 'etc.', 'a.m.', 'p.m.', 'AM.', 'PM.')
+_MIN_SENTENCE_LENGTH = 10  # Shorter text is never treated as a complete sentence
+
+
+def ends_with_sentence(text: str) -> bool:
+    """True if text ends on what is clearly the end of a sentence
+    
+    Digits before the punctuation ("$450.") and abbreviations are rejected since
+    the next chunk may continue the same sentence ("$450.50").
+    """
+    text = text.rstrip()
+    return (
+        len(text) >= _MIN_SENTENCE_LENGTH
+        and text[-1] in '.!?'
+        and not text[-2].isdigit()
+        and not text.endswith(_ABBREVIATIONS)
+    )
+
+
+class FlightAgent(Agent):
+    """Agent with STT/TTS nodes tuned for latency
+    
+    - STT: when the VAD ends the user's speech, the STT stream is flushed, which
+      makes Deepgram finalize the utterance right away instead of waiting on its
+      own endpointing.
+    - TTS: the first sentence of each reply is flushed immediately. Streaming TTS
+      plugins hold a sentence back until the next one starts, so a reply whose
+      LLM stream pauses after its first sentence (e.g. before a tool call) would
+      wait for more text before any audio is generated.
+    """
+    
+    async def stt_node(self, audio: AsyncIterable[rtc.AudioFrame], model_settings: ModelSettings) -> AsyncIterator[stt.SpeechEvent]:
+        stt_engine = self.session.stt
+        if stt_engine is None or not stt_engine.capabilities.streaming:
+            async for event in Agent.default.stt_node(self, audio, model_settings):
+                yield event
+            return
+        
+        async with stt_engine.stream() as stream:
+            
+            def on_user_state_changed(event):
+                # speaking -> listening is the VAD's end of speech
+                if event.old_state == "speaking" and event.new_state == "listening":
+                    stream.flush()
+            
+            async def forward_input():
+                async for frame in audio:
+                    stream.push_frame(frame)
+            
+            self.session.on("user_state_changed", on_user_state_changed)
+            forward_task = asyncio.create_task(forward_input())
+            try:
+                async for event in stream:
+                    yield event
+            finally:
+                self.session.off("user_state_changed", on_user_state_changed)
+                await cancel_and_wait(forward_task)
+    
+    async def tts_node(self, text: AsyncIterable[str], model_settings: ModelSettings) -> AsyncIterator[rtc.AudioFrame]:
+        tts_engine = self.session.tts
+        if tts_engine is None or not tts_engine.capabilities.streaming:
+            async for frame in Agent.default.tts_node(self, text, model_settings):
+                yield frame
+            return
+        
+        async with tts_engine.stream() as stream:
+            
+            async def forward_input():
+                head = ""  # Text before the first sentence boundary
+                async for chunk in text:
+                    stream.push_text(chunk)
+                    if head is None:
+                        continue
+                    head += chunk
+                    if ends_with_sentence(head):
+                        stream.flush()
+                        head = None
+                    elif _SENTENCE_END.search(head):
+                        # The tokenizer has already seen the boundary
+                        head = None
+                stream.end_input()
+            
+            forward_task = asyncio.create_task(forward_input())
+            try:
+                async for ev in stream:
+                    yield ev.frame
+            finally:
+                await cancel_and_wait(forward_task)
 
 # Global dictionary to store session state outside of AgentSession
 # This enables persistence across disconnections
 PARTICIPANT_SESSIONS: Dict[str, Dict] = {}
+SESSION_RETENTION_SECONDS = 300  # Keep a disconnected participant's session for 5 minutes
 
 # Global flag to track if we're waiting for text display confirmation
 WAITING_FOR_TEXT_DISPLAY: Dict[str, bool] = {}
 
+# Parsed participant metadata keyed by identity. The raw string is kept alongside
+# so changed metadata is re-parsed instead of served stale.
+_PARTICIPANT_METADATA: Dict[str, tuple[str, Dict[str, Any]]] = {}
+
+# Per-participant metadata dumps during language detection are opt-in
+LOG_VERBOSE_METADATA = os.getenv("LOG_VERBOSE_METADATA", "0") == "1"
+
+# Publish a "ready to chat" test message on session start
+AGENT_DEBUG_DATAPING = os.getenv("AGENT_DEBUG_DATAPING", "0") == "1"
+
+
+def parse_participant_metadata(participant: rtc.Participant) -> Dict[str, Any]:
+    """Return participant metadata as a dict, parsing each distinct value only once"""
+    raw = participant.metadata
+    if not raw:
+        return {}
+    cached = _PARTICIPANT_METADATA.get(participant.identity)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    parsed = json_loads(raw)
+    _PARTICIPANT_METADATA[participant.identity] = (raw, parsed)
+    return parsed
+
+# Process-wide counter for data-channel speech ids (unique without a clock read)
+_speech_ids = itertools.count(1)
+
+# speech_starting payload up to the numeric part of its id; only the id varies
+_SPEECH_STARTING_PREFIX = b'{"type":"speech_starting","speech_id":"speech_'
+
+# Same idea for user transcriptions and system messages: only the JSON-encoded
+# text (and timestamp) is spliced in, the framing is built once
+_USER_TRANSCRIPTION_PREFIX = b'{"type":"transcription","speaker":"user","text":'
+_SYSTEM_MESSAGE_PREFIX = b'{"type":"system_message","speaker":"system","text":'
+
+# Queued data-channel messages that are already waiting get coalesced into one
+# {"type": "batch", "messages": [...]} packet, kept under LiveKit's ~15KiB limit
+DATA_BATCH_MAX_MESSAGES = 16
+DATA_BATCH_MAX_BYTES = 14 * 1024
+
+# Inbound data-channel messages larger than this are dropped unparsed
+MAX_DATA_MESSAGE_BYTES = 64 * 1024
+
 
 class SynchronizedSpeechController:
     """Controls text-audio synchronization for TTS playback"""
@@ -74,7 +300,7 @@ class SynchronizedSpeechController:
         self.session = session
         self.room = room
         self.pending_speeches = asyncio.Queue()
-        self.text_display_confirmations = {}
+        self.text_display_confirmations: Dict[str, asyncio.Event] = {}
         self.default_delay = 0.5  # Default delay before audio if no confirmation
         self.message_sequence = 0  # Track message sequence for ordering
         self.min_text_render_delay = 0.2  # Minimum 200ms for text to render
@@ -84,43 +310,51 @@ class SynchronizedSpeechController:
     async def synchronized_say(self, text: str, allow_interruptions: bool = True) -> Any:
         """Send text first, then play audio with proper synchronization"""
         self.message_sequence += 1
-        speech_id = f"speech_{self.message_sequence}_{time.time()}"
+        speech_id = f"speech_{next(_speech_ids)}"
         
         # Track this text so we know it was sent via synchronized_say
         self.last_synchronized_text = text
         
+        # Register before publishing so an early confirmation is not missed
+        self.text_display_confirmations[speech_id] = asyncio.Event()
+        
         # Send text to data channel immediately with sequence number
         try:
-            data = json.dumps({
+            data = json_dumps({
                 "type": "pre_speech_text",
                 "speaker": "assistant",
                 "text": text,
                 "speech_id": speech_id,
                 "sequence": self.message_sequence  # Add sequence for message ordering
-            }).encode('utf-8')
+            })
             await self.room.local_participant.publish_data(data, reliable=True)
             logger.info(f"📤 Sent pre-speech text to data channel (ID: {speech_id}, seq: {self.message_sequence})")
         except Exception as e:
             logger.error(f"Error sending pre-speech text: {e}")
         
-        # ALWAYS wait minimum time for text to render in UI
-        await asyncio.sleep(self.min_text_render_delay)
-        logger.info(f"⏱️ Waited {self.min_text_render_delay}s for text rendering")
-        
-        # Then wait for confirmation or additional timeout
-        confirmation_received = False
-        try:
-            # Wait up to 300ms more for confirmation
-            await asyncio.wait_for(
-                self._wait_for_confirmation(speech_id),
-                timeout=0.3
-            )
-            confirmation_received = True
-            logger.info(f"✅ Text display confirmed for speech {speech_id}")
-        except asyncio.TimeoutError:
-            # No confirmation received, add safety delay
-            logger.info(f"⏱️ No text display confirmation, adding {self.default_delay}s safety delay")
-            await asyncio.sleep(self.default_delay)
+        if len(text.strip()) < _MIN_SENTENCE_LENGTH:
+            # Short acknowledgements ("OK", "Sure") render instantly; don't hold
+            # the audio back for display confirmation
+            self.text_display_confirmations.pop(speech_id, None)
+        else:
+            # ALWAYS wait minimum time for text to render in UI
+            await asyncio.sleep(self.min_text_render_delay)
+            logger.info(f"⏱️ Waited {self.min_text_render_delay}s for text rendering")
+            
+            # Then wait for confirmation or additional timeout
+            try:
+                # Wait up to 300ms more for confirmation
+                await asyncio.wait_for(
+                    self._wait_for_confirmation(speech_id),
+                    timeout=0.3
+                )
+                logger.info(f"✅ Text display confirmed for speech {speech_id}")
+            except asyncio.TimeoutError:
+                # No confirmation received, add safety delay
+                logger.info(f"⏱️ No text display confirmation, adding {self.default_delay}s safety delay")
+                await asyncio.sleep(self.default_delay)
+            finally:
+                self.text_display_confirmations.pop(speech_id, None)
         
         # Now generate and play TTS - text has definitely been displayed
         logger.info(f"🎵 Starting TTS playback for speech {speech_id} after total delay")
@@ -132,13 +366,43 @@ class SynchronizedSpeechController:
     
     async def _wait_for_confirmation(self, speech_id: str):
         """Wait for text display confirmation from frontend"""
-        while speech_id not in self.text_display_confirmations:
-            await asyncio.sleep(0.05)
-        return self.text_display_confirmations.pop(speech_id)
+        await self.text_display_confirmations[speech_id].wait()
+        return True
     
     def confirm_text_displayed(self, speech_id: str):
         """Mark text as displayed by frontend"""
-        self.text_display_confirmations[speech_id] = True
+        event = self.text_display_confirmations.get(speech_id)
+        if event is not None:
+            event.set()
+
+
+# Process-wide HTTP session so flight searches reuse keep-alive connections
+# to the API server instead of paying a new TCP/TLS handshake per tool call
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session, creating it on first use"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=20,
+                ttl_dns_cache=300,  # API host doesn't move; default is 10s
+                keepalive_timeout=60,
+                enable_cleanup_closed=True
+            ),
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """Close the shared aiohttp session (registered as a job shutdown callback)"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 
 class FlightAPIClient:
@@ -146,45 +410,185 @@ class FlightAPIClient:
     
     def __init__(self):
         self.base_url = os.getenv('API_SERVER_URL', 'http://localhost:8000')
-        self.session = None
-    
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        # Optional fallback API server, queried in parallel with the primary one
+        self.backend_urls = [self.base_url]
+        fallback_url = os.getenv('FALLBACK_API_URL')
+        if fallback_url:
+            self.backend_urls.append(fallback_url)
     
     async def search_flights(self, origin: str, destination: str, date: str, preferred_airline: str = None, cabin_class: str = "economy", return_date: str = None) -> Dict[str, Any]:
-        """Call our API server which uses Amadeus SDK"""
+        """Call our API server which uses Amadeus SDK
+        
+        With a fallback configured, all backends are queried concurrently and the
+        first successful response wins; the remaining requests are cancelled.
+        """
+        json_data = {
+            "origin": origin,
+            "destination": destination,
+            "departure_date": date,
+            "cabin_class": cabin_class
+        }
+        if preferred_airline:
+            json_data["preferred_airline"] = preferred_airline
+        if return_date:
+            json_data["return_date"] = return_date
+        
+        if len(self.backend_urls) == 1:
+            return await self._call_backend(self.base_url, json_data)
+        
+        pending = {
+            asyncio.create_task(self._call_backend(url, json_data))
+            for url in self.backend_urls
+        }
+        result = None
         try:
-            json_data = {
-                "origin": origin,
-                "destination": destination,
-                "departure_date": date,
-                "cabin_class": cabin_class
-            }
-            if preferred_airline:
-                json_data["preferred_airline"] = preferred_airline
-            if return_date:
-                json_data["return_date"] = return_date
-                
-            async with self.session.post(
-                f"{self.base_url}/search_flights",
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if "error" not in result:
+                        return result
+            # Every backend failed; report the last error
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _call_backend(self, base_url: str, json_data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a search to one API server, returning {"error": ...} on failure"""
+        try:
+            session = await get_http_session()
+            async with session.post(
+                f"{base_url}/search_flights",
                 json=json_data
             ) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    data = await response.json(loads=json_loads)
                     return data
                 else:
-                    logger.error(f"API error: {response.status}")
+                    logger.error(f"API error from {base_url}: {response.status}")
                     return {"error": f"API returned {response.status}"}
         except Exception as e:
-            logger.error(f"Request failed: {e}")
+            logger.error(f"Request to {base_url} failed: {e}")
             return {"error": str(e)}
 
 
+# Airline codes/short names users commonly say, mapped (casefolded) to a
+# substring of the airline name the API returns
+_AIRLINE_ALIASES = {
+    "aa": "american",
+    "ua": "united",
+    "dl": "delta",
+    "wn": "southwest",
+    "b6": "jetblue",
+    "as": "alaska",
+    "nk": "spirit",
+    "f9": "frontier",
+    "ba": "british airways",
+    "lh": "lufthansa",
+    "af": "air france",
+    "ib": "iberia",
+    "tk": "turkish",
+}
+
+# Price strings the API uses when a fare could not be fetched
+_UNAVAILABLE_PRICES = frozenset({'check website', 'n/a', 'not available', ''})
+
+
+def _price_to_float(price: str) -> float:
+    """Convert a cleaned price string to float (inf if it is not a number)"""
+    try:
+        return float(price)
+    except ValueError:
+        return float('inf')
+
+
+def parse_prices(flights: list) -> np.ndarray:
+    """Parse all flight prices at once into a float array
+    
+    Currency symbols and thousands separators are stripped; missing or
+    unavailable prices become inf so they sort after every real fare.
+    """
+    if not flights:
+        return np.empty(0, dtype=np.float64)
+    raw = np.array([str(flight.get('price', 'inf')) for flight in flights])
+    cleaned = np.char.strip(np.char.replace(np.char.replace(raw, '$', ''), ',', ''))
+    unavailable = np.isin(np.char.lower(cleaned), tuple(_UNAVAILABLE_PRICES))
+    cleaned = np.where(unavailable, 'inf', cleaned)
+    try:
+        return cleaned.astype(np.float64)
+    except ValueError:
+        # Some price is free text (e.g. "USD 450"); convert element by element
+        return np.array([_price_to_float(p) for p in cleaned], dtype=np.float64)
+
+
+# Recent search results keyed by the normalized query, so refinements of the same
+# itinerary ("what about business class?") don't hit the API server again.
+# Entries are (re)inserted at the end, so the dict stays ordered oldest first
+_FLIGHT_CACHE: Dict[tuple, tuple[float, Dict[str, Any]]] = {}
+_FLIGHT_CACHE_TTL = 600  # 10 minutes
+
+# Searches currently in progress, so concurrent identical queries share one call
+_FLIGHT_SEARCHES_IN_FLIGHT: Dict[tuple, asyncio.Task] = {}
+
+
+async def _search_and_cache(client: FlightAPIClient, key: tuple, *args) -> Dict[str, Any]:
+    """Run one upstream search and cache a successful response"""
+    results = await client.search_flights(*args)
+    # Only successful responses are cached so errors are retried next turn
+    if "error" not in results:
+        _FLIGHT_CACHE.pop(key, None)
+        _FLIGHT_CACHE[key] = (time.monotonic(), results)
+    return results
+
+
+async def cached_flight_search(
+    client: FlightAPIClient,
+    origin: str,
+    destination: str,
+    departure_date: str,
+    preferred_airline: str = None,
+    cabin_class: str = "economy",
+    return_date: str = None
+) -> Dict[str, Any]:
+    """Search flights through the TTL cache, collapsing concurrent identical searches"""
+    key = (
+        origin.lower().strip(),
+        destination.lower().strip(),
+        departure_date,
+        (preferred_airline or '').lower(),
+        cabin_class or 'economy',
+        return_date or ''
+    )
+    
+    # Lazily evict expired entries from the old end; stop at the first fresh one
+    now = time.monotonic()
+    while _FLIGHT_CACHE:
+        oldest = next(iter(_FLIGHT_CACHE))
+        if now - _FLIGHT_CACHE[oldest][0] <= _FLIGHT_CACHE_TTL:
+            break
+        del _FLIGHT_CACHE[oldest]
+    
+    cached = _FLIGHT_CACHE.get(key)
+    if cached is not None:
+        logger.info(f"♻️ Using cached flight results for {key}")
+        return cached[1]
+    
+    task = _FLIGHT_SEARCHES_IN_FLIGHT.get(key)
+    if task is not None:
+        logger.info(f"⏳ Joining in-flight search for {key}")
+    else:
+        # The search runs as its own task: cancelling one caller (e.g. the user
+        # interrupts) leaves it running for the others, and its result or
+        # exception reaches every waiter
+        task = asyncio.create_task(_search_and_cache(
+            client, key, origin, destination, departure_date, preferred_airline, cabin_class, return_date
+        ))
+        _FLIGHT_SEARCHES_IN_FLIGHT[key] = task
+        task.add_done_callback(lambda _: _FLIGHT_SEARCHES_IN_FLIGHT.pop(key, None))
+    return await asyncio.shield(task)
+
+
 @function_tool
 async def search_flights(
     context: RunContext,
@@ -213,137 +617,140 @@ async def search_flights(
                 (f", returning {return_date}" if return_date else "") + 
                 f", airline: {preferred_airline}, class: {cabin_class}")
     
-    async with FlightAPIClient() as client:
-        try:
-            results = await client.search_flights(origin, destination, departure_date, preferred_airline, cabin_class, return_date)
+    client = FlightAPIClient()
+    try:
+        results = await cached_flight_search(client, origin, destination, departure_date, preferred_airline, cabin_class, return_date)
+        
+        if "error" in results:
+            return {
+                "status": "error",
+                "message": f"I'm having trouble searching for flights: {results['error']}"
+            }
+        
+        flights = results.get('flights', [])
+        
+        if flights:
+            flight_count = len(flights)
             
-            if "error" in results:
-                return {
-                    "status": "error",
-                    "message": f"I'm having trouble searching for flights: {results['error']}"
-                }
+            # Parse every price once (handles price strings with currency symbols)
+            prices = parse_prices(flights)
             
-            flights = results.get('flights', [])
+            # Single pass: separate nonstop and connecting flights, flag
+            # unavailable prices and check whether we found the preferred airline
+            preferred = None
+            if preferred_airline:
+                preferred = preferred_airline.strip().casefold()
+                preferred = _AIRLINE_ALIASES.get(preferred, preferred)
+            airline_found = False
+            nonstop_flights = []
+            connecting_flights = []
+            nonstop_idx = []
+            connecting_idx = []
+            price_unavailable = []
+            for i, flight in enumerate(flights):
+                stops = flight.get('stops', 0)
+                if stops == 0:
+                    nonstop_flights.append(flight)
+                    nonstop_idx.append(i)
+                elif stops > 0:
+                    connecting_flights.append(flight)
+                    connecting_idx.append(i)
+                price = flight.get('price', '')
+                price_unavailable.append(
+                    isinstance(price, str) and price.strip().lower() in _UNAVAILABLE_PRICES
+                )
+                if preferred and not airline_found and preferred in flight.get('airline', '').casefold():
+                    airline_found = True
             
-            if flights:
-                flight_count = len(flights)
-                
-                # Get cheapest flight (handle price strings with currency symbols)
-                def get_price(flight):
-                    price = flight.get('price', '999999')
-                    # Remove currency symbols and convert to float
-                    if isinstance(price, str):
-                        price = price.replace('$', '').replace(',', '').strip()
-                        # Handle cases where price is not a number
-                        if price.lower() in ['check website', 'n/a', 'not available', '']:
-                            return 999999.0
-                        try:
-                            return float(price)
-                        except ValueError:
-                            return 999999.0
-                    return float(price)
-                
-                cheapest = min(flights, key=get_price)
-                
-                # Check if we found the preferred airline
-                airline_found = False
-                if preferred_airline:
-                    airline_found = any(preferred_airline.lower() in flight.get('airline', '').lower() for flight in flights)
-                
-                # Separate nonstop and connecting flights
-                nonstop_flights = [f for f in flights if f.get('stops', 0) == 0]
-                connecting_flights = [f for f in flights if f.get('stops', 0) > 0]
-                
-                # Track airlines with unavailable prices
-                airlines_without_prices = set()
-                
-                # Helper to format price for display
-                def format_price(flight):
-                    price = flight.get('price', '')
-                    airline = flight.get('airline', '')
-                    if isinstance(price, str):
-                        price_lower = price.lower()
-                        if price_lower in ['check website', 'n/a', 'not available', '']:
-                            airlines_without_prices.add(airline)
-                            return "price not available"
-                    return price
-                
-                # Format response in human-friendly way
-                response_parts = []
-                
+            # Airlines shown without a price, in display order (may repeat)
+            airlines_without_prices = []
+            
+            # Helper to format price for display
+            def format_price(i):
+                flight = flights[i]
+                if price_unavailable[i]:
+                    airlines_without_prices.append(flight.get('airline', ''))
+                    return "price not available"
+                return flight.get('price', '')
+            
+            # Format response in human-friendly way
+            response_parts = []
+            
+            if nonstop_flights:
+                response_parts.append("Non stop flights:")
+                for i in nonstop_idx[:5]:
+                    response_parts.append(
+                        f"- Airline: {flights[i]['airline']}, Price: {format_price(i)}"
+                    )
+            
+            if connecting_flights:
                 if nonstop_flights:
-                    response_parts.append("Non stop flights:")
-                    for flight in nonstop_flights[:5]:
-                        response_parts.append(
-                            f"- Airline: {flight['airline']}, Price: {format_price(flight)}"
-                        )
-                
-                if connecting_flights:
-                    if nonstop_flights:
-                        response_parts.append("\nFlights with layover:")
-                    else:
-                        response_parts.append("Flights with layover:")
-                    
-                    # Sort by price
-                    connecting_sorted = sorted(connecting_flights, key=get_price)[:10]
-                    for flight in connecting_sorted:
-                        # Format stops information
-                        stops_info = ""
-                        if 'layovers' in flight and flight['layovers']:
-                            stops_info = f", stops: {flight['layovers']}"
-                        elif 'stops' in flight:
-                            stops_info = f", {flight['stops']} stop(s)"
-                        
-                        response_parts.append(
-                            f"- Airline: {flight['airline']}, price: {format_price(flight)}, "
-                            f"duration: {flight.get('duration', 'TBD')}{stops_info}"
-                        )
-                
-                # Add airline-specific message
-                airline_msg = ""
-                if preferred_airline and not airline_found:
-                    airline_msg = f"I couldn't find any {preferred_airline} flights on this route. Here are alternative options. "
-                elif preferred_airline and airline_found:
-                    airline_msg = f"I found {preferred_airline} flights. "
+                    response_parts.append("\nFlights with layover:")
                 else:
-                    airline_msg = "I found these flights:\n\n"
-                
-                # Build final message
-                final_message = airline_msg + "\n".join(response_parts)
+                    response_parts.append("Flights with layover:")
                 
-                # Add note about more options if needed
-                if flight_count > 15:
-                    final_message += f"\n\nShowing top results from {flight_count} total flights. Need specific times or airlines?"
-                
-                # Add note about airlines without prices
-                if airlines_without_prices:
-                    airlines_list = list(airlines_without_prices)
-                    if len(airlines_list) == 1:
-                        final_message += f"\n\nNote: I couldn't fetch the price for {airlines_list[0]} flights. You may need to check their website directly."
-                    else:
-                        final_message += f"\n\nNote: I couldn't fetch prices for these airlines: {', '.join(airlines_list)}. You may need to check their websites directly."
-                
-                return {
-                    "status": "success",
-                    "message": final_message,
-                    "flights": flights[:15],  # Return more for chat display
-                    "nonstop_count": len(nonstop_flights),
-                    "connecting_count": len(connecting_flights),
-                    "preferred_airline_found": airline_found
-                }
+                # 10 cheapest; a stable sort keeps tied fares (e.g. all the
+                # unavailable ones at inf) in API order, as sorted() did
+                order = np.argsort(prices[connecting_idx], kind='stable')[:10]
+                for i in [connecting_idx[j] for j in order]:
+                    flight = flights[i]
+                    # Format stops information
+                    stops_info = ""
+                    if 'layovers' in flight and flight['layovers']:
+                        stops_info = f", stops: {flight['layovers']}"
+                    elif 'stops' in flight:
+                        stops_info = f", {flight['stops']} stop(s)"
+                    
+                    response_parts.append(
+                        f"- Airline: {flight['airline']}, price: {format_price(i)}, "
+                        f"duration: {flight.get('duration', 'TBD')}{stops_info}"
+                    )
+            
+            # Add airline-specific message
+            airline_msg = ""
+            if preferred_airline and not airline_found:
+                airline_msg = f"I couldn't find any {preferred_airline} flights on this route. Here are alternative options. "
+            elif preferred_airline and airline_found:
+                airline_msg = f"I found {preferred_airline} flights. "
             else:
-                return {
-                    "status": "no_flights",
-                    "message": f"I couldn't find any flights from {origin} to {destination} "
-                              f"on {departure_date}. Would you like to try different dates?"
-                }
-                
-        except Exception as e:
-            logger.error(f"Search error: {e}")
+                airline_msg = "I found these flights:\n\n"
+            
+            # Build final message
+            final_message = airline_msg + "\n".join(response_parts)
+            
+            # Add note about more options if needed
+            if flight_count > 15:
+                final_message += f"\n\nShowing top results from {flight_count} total flights. Need specific times or airlines?"
+            
+            # Add note about airlines without prices
+            if airlines_without_prices:
+                airlines_list = list(dict.fromkeys(airlines_without_prices))
+                if len(airlines_list) == 1:
+                    final_message += f"\n\nNote: I couldn't fetch the price for {airlines_list[0]} flights. You may need to check their website directly."
+                else:
+                    final_message += f"\n\nNote: I couldn't fetch prices for these airlines: {', '.join(airlines_list)}. You may need to check their websites directly."
+            
             return {
-                "status": "error",
-                "message": "I'm having trouble searching for flights right now. Please try again."
+                "status": "success",
+                "message": final_message,
+                "flights": flights[:15],  # Return more for chat display
+                "nonstop_count": len(nonstop_flights),
+                "connecting_count": len(connecting_flights),
+                "preferred_airline_found": airline_found
             }
+        else:
+            return {
+                "status": "no_flights",
+                "message": f"I couldn't find any flights from {origin} to {destination} "
+                          f"on {departure_date}. Would you like to try different dates?"
+            }
+            
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return {
+            "status": "error",
+            "message": "I'm having trouble searching for flights right now. Please try again."
+        }
 
 
 def prewarm(proc: JobProcess):
@@ -391,7 +798,12 @@ def prewarm(proc: JobProcess):
     logger.info("   - activation_threshold: 0.35 (balanced sensitivity)")
     logger.info("   NOTE: Silero VAD only supports 8kHz and 16kHz")
     
-    proc.userdata["vad"] = silero.VAD.load(**vad_configs["medium"])
+    # Preload one VAD per environment so switching environments is just a lookup
+    proc.userdata["vads"] = {
+        environment: silero.VAD.load(**config)
+        for environment, config in vad_configs.items()
+    }
+    proc.userdata["vad"] = proc.userdata["vads"]["medium"]
     proc.userdata["current_environment"] = "medium"
     
     logger.info("✅ VAD loaded with adaptive configuration support")
@@ -410,7 +822,13 @@ class ResamplingAudioOutput(io.AudioOutput):
         self.room = room
         self.audio_source = rtc.AudioSource(sample_rate=48000, num_channels=1)
         self.track_published = False
-        self.frame_buffer = AudioFrameBuffer(sample_rate=48000)
+        # Progressive framing: 10ms first frame for fast time-to-first-audio,
+        # growing to 50ms frames for the rest of the utterance
+        self.frame_buffer = AudioFrameBuffer(sample_rate=48000, max_frame_duration_ms=50)
+        # Streaming resampler (libsoxr via the rtc FFI), created for the first
+        # non-48kHz frame and kept across frames so filter state carries over
+        self._resampler: Optional[rtc.AudioResampler] = None
+        self._resampler_rate = 0
         logger.info("Created ResamplingAudioOutput with 48kHz AudioSource")
         
     async def start(self):
@@ -439,17 +857,20 @@ class ResamplingAudioOutput(io.AudioOutput):
         """Capture audio frame, resampling if necessary"""
         if frame.sample_rate != 48000:
             # Resample to 48kHz
-            resampled_data = resample_audio(
-                frame.data, 
-                original_rate=frame.sample_rate,
-                target_rate=48000
-            )
+            if self._resampler is None or self._resampler_rate != frame.sample_rate:
+                self._resampler = rtc.AudioResampler(
+                    input_rate=frame.sample_rate,
+                    output_rate=48000,
+                    num_channels=1,
+                    quality=rtc.AudioResamplerQuality.MEDIUM
+                )
+                self._resampler_rate = frame.sample_rate
             
             # Create frames from resampled data
-            frames = self.frame_buffer.add_data(resampled_data)
-            for new_frame in frames:
-                self.audio_source.capture_frame(new_frame)
-                logger.debug(f"Captured resampled frame: {frame.sample_rate}Hz → 48kHz")
+            for resampled in self._resampler.push(frame):
+                for new_frame in self.frame_buffer.add_data(resampled.data):
+                    self.audio_source.capture_frame(new_frame)
+                    logger.debug(f"Captured resampled frame: {frame.sample_rate}Hz → 48kHz")
         else:
             # Already at 48kHz
             self.audio_source.capture_frame(frame)
@@ -461,10 +882,17 @@ class ResamplingAudioOutput(io.AudioOutput):
     def clear_buffer(self):
         """Clear any buffered audio"""
         if hasattr(self, 'frame_buffer'):
-            self.frame_buffer.buffer.clear()
+            self.frame_buffer.clear()
+        # Drop resampler state so interrupted audio doesn't leak into the next speech
+        self._resampler = None
     
     async def flush(self):
         """Flush any remaining audio"""
+        if self._resampler is not None:
+            for resampled in self._resampler.flush():
+                for frame in self.frame_buffer.add_data(resampled.data):
+                    self.audio_source.capture_frame(frame)
+            self._resampler = None
         if hasattr(self, 'frame_buffer'):
             frames = self.frame_buffer.flush()
             for frame in frames:
@@ -487,25 +915,359 @@ async def test_audio_tone(room: rtc.Room, duration: float = 1.0):
     await room.local_participant.publish_track(track, options)
     
     # Generate test tone
-    audio_data = await generate_test_tone(frequency=440, duration=duration, sample_rate=48000)
+    audio_data = generate_test_tone(frequency=440, duration=duration, sample_rate=48000)
     
-    # Send in 10ms chunks
+    # Build all 10ms frames up front so the paced loop only captures
     chunk_size = 480 * 2  # 480 samples * 2 bytes per sample
-    for i in range(0, len(audio_data), chunk_size):
-        chunk = audio_data[i:i+chunk_size]
-        if len(chunk) == chunk_size:
-            frame = rtc.AudioFrame(
-                data=chunk,
-                sample_rate=48000,
-                num_channels=1,
-                samples_per_channel=480
-            )
-            await audio_source.capture_frame(frame)
-            await asyncio.sleep(0.01)  # 10ms
+    frames = [
+        rtc.AudioFrame(
+            data=audio_data[i:i+chunk_size],
+            sample_rate=48000,
+            num_channels=1,
+            samples_per_channel=480
+        )
+        for i in range(0, len(audio_data) - chunk_size + 1, chunk_size)
+    ]
+    
+    # Pace against a monotonic deadline so sleep overshoot doesn't accumulate
+    start = time.monotonic()
+    for index, frame in enumerate(frames):
+        await audio_source.capture_frame(frame)
+        await asyncio.sleep(max(0.0, start + (index + 1) * 0.01 - time.monotonic()))
     
     logger.info("✅ Test tone complete - you should have heard a beep!")
 
 
+# Session and room events that are only logged. These handlers hold no
+# per-session state, so they are defined once here and registered by every
+# entrypoint instead of being recreated as closures for each session.
+def on_user_state_changed(event):
+    try:
+        # UserStateChangedEvent has old_state and new_state properties
+        logger.info(f"👤 USER STATE CHANGED: {event.old_state} -> {event.new_state}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📋 USER_STATE_CHANGED Event Structure:")
+            logger.debug(f"   - Type: {type(event)}")
+            logger.debug(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+    except AttributeError as e:
+        logger.error(f"❌ User state event error: {e}")
+        logger.info(f"👤 Raw user state event: {event}")
+
+
+def on_agent_state_changed(event):
+    try:
+        # AgentStateChangedEvent has old_state and new_state properties
+        logger.info(f"🤖 AGENT STATE CHANGED: {event.old_state} -> {event.new_state}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📋 AGENT_STATE_CHANGED Event Structure:")
+            logger.debug(f"   - Type: {type(event)}")
+            logger.debug(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+    except AttributeError as e:
+        logger.error(f"❌ Agent state event error: {e}")
+        logger.info(f"🤖 Raw agent state event: {event}")
+
+
+def on_function_call(event):
+    try:
+        # FunctionCallEvent has function_call_id and function_name
+        logger.info(f"🔧 FUNCTION CALLED: {event.function_name} (ID: {event.function_call_id})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📋 FUNCTION_CALL Event Structure:")
+            logger.debug(f"   - Type: {type(event)}")
+            logger.debug(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+        if hasattr(event, 'arguments'):
+            logger.info(f"   - Arguments: {event.arguments}")
+    except AttributeError as e:
+        logger.error(f"❌ Function call event error: {e}")
+        logger.info(f"🔧 Raw function call event: {event}")
+
+
+# Enhanced event monitoring for debugging text injection
+def on_function_tools_executed(event):
+    """Monitor when tools are executed"""
+    try:
+        logger.info(f"🛠️ FUNCTION TOOLS EXECUTED")
+        # Debug the event structure
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"   Event type: {type(event)}")
+            logger.debug(f"   Event attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+        
+        # Try different ways to access the data
+        if hasattr(event, 'tool_calls'):
+            for tool_call in event.tool_calls:
+                logger.info(f"   - Tool: {tool_call.tool_name}")
+                logger.info(f"   - Result: {tool_call.result}")
+        elif hasattr(event, 'called_functions'):
+            for call_info, result in event.called_functions:
+                logger.info(f"   - Tool: {call_info.name}")
+                logger.info(f"   - Result: {result}")
+        else:
+            logger.info(f"   Raw event: {event}")
+    except Exception as e:
+        logger.error(f"❌ Error in function_tools_executed handler: {e}")
+
+
+# Monitor TTS events
+def on_tts_started(event):
+    logger.info("🎵 TTS STARTED: Generating audio...")
+
+
+def on_tts_stopped(event):
+    logger.info("🎵 TTS STOPPED")
+
+
+# Monitor when audio is actually being sent
+def _log_tts_metrics(tts_metrics: metrics.TTSMetrics):
+    logger.info(f"📊 TTS Metrics: duration={tts_metrics.audio_duration}s")
+
+
+def _log_stt_metrics(stt_metrics: metrics.STTMetrics):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"📊 STT Metrics: {stt_metrics}")
+
+
+_METRICS_LOGGERS = {
+    metrics.TTSMetrics: _log_tts_metrics,
+    metrics.STTMetrics: _log_stt_metrics,
+}
+
+
+def on_metrics(event):
+    collected = event.metrics
+    log_metrics = _METRICS_LOGGERS.get(type(collected))
+    if log_metrics is not None:
+        log_metrics(collected)
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"📊 Metrics: {collected.type}")
+
+
+# Monitor track publishing
+def on_track_published(publication: rtc.LocalTrackPublication, participant: rtc.LocalParticipant):
+    logger.info(f"📡 Track published: {publication.kind} by {participant.identity}")
+
+
+_SESSION_LOG_HANDLERS = {
+    "user_state_changed": on_user_state_changed,
+    "agent_state_changed": on_agent_state_changed,
+    "function_call": on_function_call,
+    "function_tools_executed": on_function_tools_executed,
+    "tts_started": on_tts_started,
+    "tts_stopped": on_tts_stopped,
+    "metrics_collected": on_metrics,
+}
+
+
+class DataChannelContext(NamedTuple):
+    """Per-session state the data-channel message handlers need"""
+    job_ctx: JobContext
+    session: AgentSession
+    speech_controller: SynchronizedSpeechController
+    test_harness: Any
+    data_queue: asyncio.Queue
+    participant: Optional[rtc.RemoteParticipant]
+
+
+def handle_config_update(message: dict, dc: DataChannelContext):
+    if 'interruptions_enabled' in message:
+        if hasattr(dc.job_ctx.room, 'speech_controller'):
+            dc.job_ctx.room.speech_controller.interruptions_enabled = message['interruptions_enabled']
+            logger.info(f"🤚 Interruptions {'enabled' if message['interruptions_enabled'] else 'disabled'} by user")
+
+
+async def inject_test_input(text: str, dc: DataChannelContext, correlation_id=None):
+    """Feed text into the STT-LLM-TTS pipeline as if the user said it and wait for the reply"""
+    session = dc.session
+    error = None
+    try:
+        logger.info(f"🧪 Using session.generate_reply() to inject text: {text}")
+        
+        # Interrupt any ongoing speech
+        session.interrupt()
+        
+        # Queue the transcription for UI display so its publish
+        # overlaps with generating the reply
+        try:
+            trans_data = _USER_TRANSCRIPTION_PREFIX + json_dumps(text) + b'}'
+            dc.data_queue.put_nowait(trans_data)
+            logger.info("✅ Queued user transcription for data channel")
+        except Exception as e:
+            logger.error(f"Error sending transcription: {e}")
+        
+        # Inject text as if user spoke it using the official method
+        speech_handle = await session.generate_reply(
+            user_input=text,
+            allow_interruptions=True
+        )
+        
+        logger.info("🧪 Text injected into pipeline, waiting for completion...")
+        
+        # Wait for agent to complete response
+        await speech_handle.wait_for_playout()
+        
+        logger.info("🧪 Agent response completed")
+        
+    except Exception as e:
+        error = str(e)
+        logger.error(f"❌ Error injecting text input: {e}")
+        # Fallback error message
+        session.say("I'm having trouble processing that request. Please try again.", 
+                   allow_interruptions=True)
+    
+    # Optional id from the test client; echoed back once the reply has played out
+    # so the client can wait for that instead of sleeping a fixed time
+    if correlation_id is not None:
+        dc.data_queue.put_nowait(json_dumps({
+            "type": "test_user_input_done",
+            "correlation_id": correlation_id,
+            "error": error
+        }))
+
+
+def handle_test_user_input(message: dict, dc: DataChannelContext):
+    """Inject test text (not regular transcriptions) with session.generate_reply()"""
+    text = message.get('text')
+    if not text:
+        return
+    participant_id = dc.participant.identity if dc.participant else "unknown"
+    logger.info(f"🧪 TEST INPUT received from {participant_id}: {text}")
+    asyncio.create_task(inject_test_input(text, dc, message.get('correlation_id')))
+
+
+def handle_test_user_input_batch(message: dict, dc: DataChannelContext):
+    """Inject several test inputs sent in one packet, one reply at a time
+
+    Each entry is {"text": ..., "idx": ...}; the idx doubles as the correlation
+    id of its test_user_input_done message.
+    """
+    messages = message.get('messages')
+    if not isinstance(messages, list):
+        return
+    # Skip malformed entries rather than dropping the whole batch
+    entries = [entry for entry in messages if isinstance(entry, dict) and isinstance(entry.get('text'), str) and entry['text']]
+    if not entries:
+        return
+    participant_id = dc.participant.identity if dc.participant else "unknown"
+    logger.info(f"🧪 TEST INPUT BATCH received from {participant_id}: {len(entries)} messages")
+    
+    async def inject_batch():
+        for entry in entries:
+            await inject_test_input(entry['text'], dc, entry.get('idx'))
+    
+    asyncio.create_task(inject_batch())
+
+
+def handle_run_test_harness(message: dict, dc: DataChannelContext):
+    logger.info("🧪 Running automated test harness")
+    test_harness = dc.test_harness
+    
+    async def run_automated_tests():
+        # Add test cases (gather keeps them in order)
+        await asyncio.gather(
+            test_harness.add_test(
+                "Find flights from New York to London", 
+                expected_tool="search_flights"
+            ),
+            test_harness.add_test(
+                "What about morning flights only?",
+                expected_tool="search_flights"
+            ),
+            test_harness.add_test(
+                "Show me business class options",
+                expected_tool="search_flights"
+            ),
+        )
+        
+        # Run all tests
+        await test_harness.run_tests()
+    
+    asyncio.create_task(run_automated_tests())
+
+
+def handle_text_displayed(message: dict, dc: DataChannelContext):
+    """Text display confirmation from the frontend"""
+    speech_id = message.get('speech_id')
+    if not speech_id:
+        return
+    logger.info(f"✅ Frontend confirmed text display for speech {speech_id}")
+    dc.speech_controller.confirm_text_displayed(speech_id)
+
+
+def handle_environment_update(message: dict, dc: DataChannelContext):
+    """Switch the session VAD to the environment selected in the frontend"""
+    userdata = dc.job_ctx.proc.userdata
+    new_environment = message.get('environment', 'medium')
+    logger.info(f"🌍 ENVIRONMENT UPDATE: {new_environment}")
+    
+    # Get VAD configs from prewarm
+    vad_configs = userdata.get("vad_configs", {})
+    
+    if new_environment not in vad_configs:
+        logger.warning(f"⚠️ Unknown environment: {new_environment}")
+        return
+    
+    # Switch VAD to the new configuration
+    logger.info(f"🔄 Switching VAD to {new_environment} settings...")
+    new_config = vad_configs[new_environment]
+    
+    # Log the new settings
+    logger.info(f"   - min_silence_duration: {new_config['min_silence_duration']}s")
+    logger.info(f"   - activation_threshold: {new_config['activation_threshold']}")
+    
+    # Use the VAD preloaded for this environment
+    vads = userdata.setdefault("vads", {})
+    new_vad = vads.get(new_environment)
+    if new_vad is not None:
+        _apply_environment_vad(new_environment, new_vad, dc)
+        return
+    
+    # Config added after prewarm: load it off the event loop (model load is
+    # blocking) and cache it for the next switch
+    async def load_and_apply():
+        logger.info(f"📊 Loading VAD for {new_environment} (not preloaded)")
+        try:
+            loaded_vad = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(silero.VAD.load, **new_config)
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to load VAD for {new_environment}: {e}")
+            return
+        vads[new_environment] = loaded_vad
+        _apply_environment_vad(new_environment, loaded_vad, dc)
+    
+    asyncio.create_task(load_and_apply())
+
+
+def _apply_environment_vad(new_environment: str, new_vad, dc: DataChannelContext):
+    """Swap in the environment's VAD and confirm the change in the chat"""
+    # Update the VAD in the agent session
+    dc.session._vad = new_vad
+    
+    # Store current environment
+    dc.job_ctx.proc.userdata["current_environment"] = new_environment
+    
+    logger.info(f"✅ VAD updated to {new_environment} environment settings")
+    
+    # Send confirmation to chat only (no voice announcement)
+    confirmation_text = f"Voice detection adjusted for {new_environment} environment."
+    # Don't announce via voice - just send to chat
+    confirmation_data = (
+        _SYSTEM_MESSAGE_PREFIX + json_dumps(confirmation_text)
+        + b',"timestamp":' + json_dumps(datetime.now(timezone.utc)) + b'}'
+    )
+    dc.data_queue.put_nowait(confirmation_data)
+
+
+# Data-channel message type -> handler, looked up once per packet
+_DATA_MESSAGE_HANDLERS = {
+    "config_update": handle_config_update,
+    "test_user_input": handle_test_user_input,
+    "test_user_input_batch": handle_test_user_input_batch,
+    "run_test_harness": handle_run_test_harness,
+    "text_displayed": handle_text_displayed,
+    "environment_update": handle_environment_update,
+}
+
+
 async def entrypoint(ctx: JobContext):
     """Main entry point for the LiveKit agent with version-safe persistence"""
     logger.info("="*60)
@@ -540,6 +1302,7 @@ async def entrypoint(ctx: JobContext):
         logger.info(f"📡 Connection mode: AUDIO_ONLY subscription")
         await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
         logger.info("✅ Successfully connected to room!")
+        ctx.add_shutdown_callback(close_http_session)
         logger.info(f"👥 Participants in room: {len(ctx.room.remote_participants)}")
         
         # Log all participants
@@ -556,7 +1319,7 @@ async def entrypoint(ctx: JobContext):
         logger.info(f"🏠 Room metadata: '{ctx.room.metadata}'")
         if ctx.room.metadata:
             try:
-                room_metadata = json.loads(ctx.room.metadata)
+                room_metadata = json_loads(ctx.room.metadata)
                 logger.info(f"📊 Parsed room metadata: {room_metadata}")
                 room_language = room_metadata.get("language", "en")
                 if room_language != "en":
@@ -568,26 +1331,28 @@ async def entrypoint(ctx: JobContext):
         # Check for participants already in the room
         logger.info(f"👥 Checking {len(ctx.room.remote_participants)} participants for language preference...")
         for participant in ctx.room.remote_participants.values():
-            logger.info(f"🔍 Checking participant: {participant.identity}")
-            logger.info(f"   - Metadata: '{participant.metadata}'")
-            logger.info(f"   - Metadata type: {type(participant.metadata)}")
+            if LOG_VERBOSE_METADATA:
+                logger.info(f"🔍 Checking participant: {participant.identity}")
+                logger.info(f"   - Metadata: '{participant.metadata}'")
             
-            if participant.metadata:
-                try:
-                    participant_metadata = json.loads(participant.metadata)
-                    logger.info(f"   ✅ Parsed metadata: {participant_metadata}")
-                    participant_language = participant_metadata.get("language")
-                    if participant_language:
-                        language = participant_language
-                        logger.info(f"   🎯 Got language from participant: {language}")
-                        break
-                except Exception as e:
-                    logger.error(f"   ❌ Error parsing participant metadata: {e}")
+            try:
+                participant_language = parse_participant_metadata(participant).get("language")
+            except Exception as e:
+                logger.error(f"   ❌ Error parsing participant metadata: {e}")
+                continue
+            if participant_language:
+                language = participant_language
+                logger.info(f"   🎯 Got language from {participant.identity}: {language}")
+                break
         
         logger.info("="*40)
         logger.info(f"🌍 FINAL LANGUAGE SELECTION: {language}")
         logger.info("="*40)
         
+        # The language is fixed for the session, so resolve its greetings once
+        greeting_text = get_greeting(language)
+        welcome_back_text = get_welcome_back_message(language)
+        
         # Test tone option - DISABLED (was causing weird audio)
         # logger.info("🔊 Playing test tone to verify audio...")
         # await test_audio_tone(ctx.room, duration=1.0)
@@ -606,7 +1371,7 @@ async def entrypoint(ctx: JobContext):
         # Initialize agent with flight booking instructions
         logger.info("🤖 INITIALIZING AGENT...")
         logger.info(f"📝 Agent language setting: {language}")
-        agent = Agent(
+        agent = FlightAgent(
             instructions=f"""You are a multilingual flight booking assistant powered by LiveKit and Amadeus.
 
 LANGUAGE CONFIGURATION:
@@ -766,16 +1531,23 @@ DATE HANDLING:
                     temperature=0.7
                 ),
                 tts=cartesia.TTS(),  # Use default voice
-                turn_detection="vad"
+                turn_detection="vad",
+                # The VAD already waits out min_silence_duration (0.6-1.2s) before
+                # speech end; don't stack the default 0.5s endpointing delay on top
+                min_endpointing_delay=0.2
             )
             logger.info("✅ STT-LLM-TTS pipeline configured successfully!")
             
             # Debug: Log actual STT configuration
-            if hasattr(session.stt, '_opts'):
-                logger.info(f"🔍 Actual STT options after creation:")
-                logger.info(f"   - model: {getattr(session.stt._opts, 'model', 'unknown')}")
-                logger.info(f"   - language: {getattr(session.stt._opts, 'language', 'unknown')}")
-                logger.info(f"   - detect_language: {getattr(session.stt._opts, 'detect_language', 'unknown')}")
+            if logger.isEnabledFor(logging.DEBUG):
+                stt_opts = getattr(session.stt, '_opts', None)
+                if stt_opts is not None:
+                    logger.debug(
+                        "🔍 Actual STT options after creation: model=%s language=%s detect_language=%s",
+                        getattr(stt_opts, 'model', 'unknown'),
+                        getattr(stt_opts, 'language', 'unknown'),
+                        getattr(stt_opts, 'detect_language', 'unknown'),
+                    )
         
         # Create and configure custom audio output with resampling
         logger.info("="*50)
@@ -791,109 +1563,106 @@ DATE HANDLING:
         session.output._audio = custom_audio_output
         logger.info("✅ Custom audio output with 48kHz resampling configured")
         
-        # Add event handlers for debugging with proper error handling
-        logger.info("📋 REGISTERING EVENT HANDLERS...")
+        # Fire-and-forget data-channel messages from event handlers go through one
+        # sender task, which keeps them in order and avoids a Task per message.
+        # Messages that pile up while a publish is in flight are sent as one batch.
+        data_queue: asyncio.Queue[bytes] = asyncio.Queue()
         
-        @session.on("user_state_changed")
-        def on_user_state_changed(event):
-            try:
-                # UserStateChangedEvent has old_state and new_state properties
-                logger.info(f"👤 USER STATE CHANGED: {event.old_state} -> {event.new_state}")
-                logger.info(f"📋 USER_STATE_CHANGED Event Structure:")
-                logger.info(f"   - Type: {type(event)}")
-                logger.info(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
-                logger.info(f"   - Old State: {event.old_state}")
-                logger.info(f"   - New State: {event.new_state}")
-            except AttributeError as e:
-                logger.error(f"❌ User state event error: {e}")
-                logger.info(f"👤 Raw user state event: {event}")
-        
-        @session.on("agent_state_changed")
-        def on_agent_state_changed(event):
-            try:
-                # AgentStateChangedEvent has old_state and new_state properties
-                logger.info(f"🤖 AGENT STATE CHANGED: {event.old_state} -> {event.new_state}")
-                logger.info(f"📋 AGENT_STATE_CHANGED Event Structure:")
-                logger.info(f"   - Type: {type(event)}")
-                logger.info(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
-            except AttributeError as e:
-                logger.error(f"❌ Agent state event error: {e}")
-                logger.info(f"🤖 Raw agent state event: {event}")
-        
-        @session.on("function_call")
-        def on_function_call(event):
-            try:
-                # FunctionCallEvent has function_call_id and function_name
-                logger.info(f"🔧 FUNCTION CALLED: {event.function_name} (ID: {event.function_call_id})")
-                logger.info(f"📋 FUNCTION_CALL Event Structure:")
-                logger.info(f"   - Type: {type(event)}")
-                logger.info(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
-                if hasattr(event, 'arguments'):
-                    logger.info(f"   - Arguments: {event.arguments}")
-            except AttributeError as e:
-                logger.error(f"❌ Function call event error: {e}")
-                logger.info(f"🔧 Raw function call event: {event}")
-        
-        # Enhanced event monitoring for debugging text injection
-        @session.on("function_tools_executed")
-        def on_function_tools_executed(event):
-            """Monitor when tools are executed"""
-            try:
-                logger.info(f"🛠️ FUNCTION TOOLS EXECUTED")
-                # Debug the event structure
-                logger.info(f"   Event type: {type(event)}")
-                logger.info(f"   Event attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+        async def send_queued_data():
+            pending = None  # Message that didn't fit in the previous batch
+            while True:
+                batch = [pending if pending is not None else await data_queue.get()]
+                batch_size = len(batch[0])
+                pending = None
+                while len(batch) < DATA_BATCH_MAX_MESSAGES and not data_queue.empty():
+                    payload = data_queue.get_nowait()
+                    if batch_size + len(payload) > DATA_BATCH_MAX_BYTES:
+                        pending = payload
+                        break
+                    batch.append(payload)
+                    batch_size += len(payload) + 1
                 
-                # Try different ways to access the data
-                if hasattr(event, 'tool_calls'):
-                    for tool_call in event.tool_calls:
-                        logger.info(f"   - Tool: {tool_call.tool_name}")
-                        logger.info(f"   - Result: {tool_call.result}")
-                elif hasattr(event, 'called_functions'):
-                    for call_info, result in event.called_functions:
-                        logger.info(f"   - Tool: {call_info.name}")
-                        logger.info(f"   - Result: {result}")
+                if len(batch) == 1:
+                    packet = batch[0]
                 else:
-                    logger.info(f"   Raw event: {event}")
-            except Exception as e:
-                logger.error(f"❌ Error in function_tools_executed handler: {e}")
+                    # Payloads are already JSON, so splice them instead of re-encoding
+                    packet = b'{"type":"batch","messages":[' + b','.join(batch) + b']}'
+                try:
+                    await ctx.room.local_participant.publish_data(packet, reliable=True)
+                except Exception as e:
+                    logger.error(f"Error publishing data message: {e}")
+        
+        data_sender = asyncio.create_task(send_queued_data())
+        
+        async def stop_data_sender():
+            data_sender.cancel()
+        
+        ctx.add_shutdown_callback(stop_data_sender)
+        
+        # Greetings wait for the room connection instead of a fixed 1s delay
+        room_connected = asyncio.Event()
+        if ctx.room.connection_state == rtc.ConnectionState.CONN_CONNECTED:
+            room_connected.set()
+        
+        @ctx.room.on("connection_state_changed")
+        def on_connection_state_changed(state: rtc.ConnectionState):
+            if state == rtc.ConnectionState.CONN_CONNECTED:
+                room_connected.set()
+            else:
+                room_connected.clear()
+        
+        async def wait_for_data_channel(timeout: float = 1.0):
+            """Wait (at most `timeout` seconds) until data can be published"""
+            try:
+                await asyncio.wait_for(room_connected.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Room not connected yet, sending anyway")
+        
+        # Add event handlers for debugging with proper error handling
+        logger.info("📋 REGISTERING EVENT HANDLERS...")
+        
+        for event_name, handler in _SESSION_LOG_HANDLERS.items():
+            session.on(event_name, handler)
         
         # Add handler for user speech transcriptions (v1.0.23)
+        thinking_sent = False  # Thinking indicator already sent for the current turn
         @session.on("user_input_transcribed")
         def on_user_input_transcribed(event):
-            if event.is_final:  # Only send final transcriptions
-                logger.info(f"💬 USER SAID: '{event.transcript}'")
-                # Send to data channel for chat UI
-                try:
-                    data = json.dumps({
-                        "type": "transcription",
-                        "speaker": "user", 
-                        "text": event.transcript
-                    }).encode('utf-8')
-                    asyncio.create_task(ctx.room.local_participant.publish_data(data, reliable=True))
-                    logger.info(f"✅ Sent user transcription to data channel")
-                    
-                    # OPTION 3: Send immediate "thinking" message for early text display
-                    thinking_data = json.dumps({
+            nonlocal thinking_sent
+            try:
+                # OPTION 3: Send the "thinking" message as soon as the user is
+                # clearly speaking (first substantial interim), once per turn
+                if not thinking_sent and (event.is_final or len(event.transcript.strip()) > 4):
+                    thinking_data = json_dumps({
                         "type": "thinking",
                         "speaker": "assistant",
                         "text": "Agent is thinking...",
-                        "speech_id": f"thinking_{time.time()}"
-                    }).encode('utf-8')
-                    asyncio.create_task(ctx.room.local_participant.publish_data(thinking_data, reliable=True))
+                        "speech_id": f"thinking_{next(_speech_ids)}"
+                    })
+                    data_queue.put_nowait(thinking_data)
+                    thinking_sent = True
                     logger.info(f"💭 Sent thinking indicator to UI")
-                except Exception as e:
-                    logger.error(f"Error sending user transcription: {e}")
+                
+                if event.is_final:  # Only send final transcriptions
+                    logger.info(f"💬 USER SAID: '{event.transcript}'")
+                    # Send to data channel for chat UI
+                    data = _USER_TRANSCRIPTION_PREFIX + json_dumps(event.transcript) + b'}'
+                    data_queue.put_nowait(data)
+                    thinking_sent = False
+                    logger.info(f"✅ Sent user transcription to data channel")
+            except Exception as e:
+                logger.error(f"Error sending user transcription: {e}")
         
         # Add handler for conversation items (agent responses) - v1.0.23
         @session.on("conversation_item_added") 
         def on_conversation_item_added(event):
-            logger.info(f"📋 CONVERSATION_ITEM_ADDED Event Structure:")
-            logger.info(f"   - Type: {type(event)}")
-            logger.info(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
-            logger.info(f"   - Item type: {type(event.item)}")
-            logger.info(f"   - Item attributes: {[attr for attr in dir(event.item) if not attr.startswith('_')]}")
-            logger.info(f"   - Item role: {event.item.role}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📋 CONVERSATION_ITEM_ADDED Event Structure:")
+                logger.debug(f"   - Type: {type(event)}")
+                logger.debug(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+                logger.debug(f"   - Item type: {type(event.item)}")
+                logger.debug(f"   - Item attributes: {[attr for attr in dir(event.item) if not attr.startswith('_')]}")
+                logger.debug(f"   - Item role: {event.item.role}")
             
             if event.item.role == "assistant":
                 # Strip any markdown that might have slipped through
@@ -911,8 +1680,10 @@ DATE HANDLING:
                     logger.warning(f"⚠️ Skipping empty assistant message")
                     return
                 
-                # Check if this text was already sent via synchronized_say
-                if hasattr(speech_controller, 'last_synchronized_text') and speech_controller.last_synchronized_text == clean_text:
+                # Check if this text was already sent via synchronized_say. Plain str
+                # equality is already cheap here: it bails out on a length mismatch,
+                # while hashing the fresh clean_text would always scan all of it.
+                if speech_controller.last_synchronized_text == clean_text:
                     logger.info(f"🔄 Text already sent via synchronized_say, skipping duplicate")
                     # Reset the tracking
                     speech_controller.last_synchronized_text = None
@@ -924,14 +1695,14 @@ DATE HANDLING:
                         # Only synchronized_say uses sequence numbers
                         
                         # Send as pre_speech_text for early display
-                        data = json.dumps({
+                        data = json_dumps({
                             "type": "pre_speech_text",
                             "speaker": "assistant",
                             "text": clean_text,
-                            "speech_id": f"response_{time.time()}",
+                            "speech_id": f"response_{next(_speech_ids)}",
                             "is_final": True  # This is the actual response
-                        }).encode('utf-8')
-                        asyncio.create_task(ctx.room.local_participant.publish_data(data, reliable=True))
+                        })
+                        data_queue.put_nowait(data)
                         logger.info(f"✅ Sent agent response as pre_speech_text for early display")
                     except Exception as e:
                         logger.error(f"Error sending agent response: {e}")
@@ -941,64 +1712,32 @@ DATE HANDLING:
         @session.on("speech_created")
         def on_speech_created(event):
             logger.info(f"🎵 Speech created - Audio channel active: {event}")
-            logger.info(f"📋 SPEECH_CREATED Event Structure:")
-            logger.info(f"   - Type: {type(event)}")
-            logger.info(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
-            if hasattr(event, 'speech_handle'):
-                handle = event.speech_handle
-                logger.info(f"   - Speech Handle type: {type(handle)}")
-                logger.info(f"   - Speech Handle attributes: {[attr for attr in dir(handle) if not attr.startswith('_')]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📋 SPEECH_CREATED Event Structure:")
+                logger.debug(f"   - Type: {type(event)}")
+                logger.debug(f"   - Attributes: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+                if hasattr(event, 'speech_handle'):
+                    handle = event.speech_handle
+                    logger.debug(f"   - Speech Handle type: {type(handle)}")
+                    logger.debug(f"   - Speech Handle attributes: {[attr for attr in dir(handle) if not attr.startswith('_')]}")
                 
             # Send notification that speech is starting
-            async def notify_speech_starting():
-                try:
-                    speech_id = f"speech_{time.time()}"
-                    data = json.dumps({
-                        "type": "speech_starting",
-                        "speech_id": speech_id
-                    }).encode('utf-8')
-                    await ctx.room.local_participant.publish_data(data, reliable=True)
-                    logger.info(f"📢 Notified frontend that speech is starting")
-                except Exception as e:
-                    logger.error(f"Error notifying speech start: {e}")
-            
-            asyncio.create_task(notify_speech_starting())
-            
-        # Monitor TTS events
-        @session.on("tts_started")
-        def on_tts_started(event):
-            logger.info("🎵 TTS STARTED: Generating audio...")
-        
-        @session.on("tts_stopped") 
-        def on_tts_stopped(event):
-            logger.info("🎵 TTS STOPPED")
+            data_queue.put_nowait(b'%s%d"}' % (_SPEECH_STARTING_PREFIX, next(_speech_ids)))
+            logger.info(f"📢 Notified frontend that speech is starting")
             
-        # Monitor when audio is actually being sent
-        @session.on("metrics_collected")
-        def on_metrics(event):
-            if hasattr(event, 'metrics') and hasattr(event.metrics, 'type'):
-                if event.metrics.type == 'tts_metrics':
-                    logger.info(f"📊 TTS Metrics: duration={getattr(event.metrics, 'audio_duration', 'unknown')}s")
-                elif event.metrics.type == 'stt_metrics':
-                    logger.debug(f"📊 STT Metrics: {event.metrics}")
-                else:
-                    logger.debug(f"📊 Metrics: {event.metrics.type}")
-        
-        
         # Monitor track publishing
-        @ctx.room.on("track_published")
-        def on_track_published(publication: rtc.LocalTrackPublication, participant: rtc.LocalParticipant):
-            logger.info(f"📡 Track published: {publication.kind} by {participant.identity}")
+        ctx.room.on("track_published", on_track_published)
         
         # Handle participant metadata updates
         @ctx.room.on("participant_metadata_changed")
         def on_participant_metadata_changed(participant: rtc.Participant, prev_metadata: str):
             logger.info(f"📝 METADATA CHANGED for {participant.identity}")
-            logger.info(f"   - Previous: '{prev_metadata}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"   - Previous: '{prev_metadata}'")
             logger.info(f"   - Current: '{participant.metadata}'")
             if participant.metadata:
                 try:
-                    metadata = json.loads(participant.metadata)
+                    metadata = parse_participant_metadata(participant)
                     new_language = metadata.get("language")
                     if new_language and new_language != language:
                         logger.info(f"🌐 Language preference updated to: {new_language}")
@@ -1010,7 +1749,7 @@ DATE HANDLING:
         @ctx.room.on("track_subscribed")
         def on_track_subscribed(
             track: rtc.Track, 
-            publication: rtc.TrackPublication, 
+            _publication: rtc.TrackPublication,  # unused
             participant: rtc.RemoteParticipant
         ):
             logger.info(f"📡 TRACK SUBSCRIBED: {track.kind} from {participant.identity}")
@@ -1019,7 +1758,7 @@ DATE HANDLING:
                 # Check if participant has language preference
                 if participant.metadata:
                     try:
-                        metadata = json.loads(participant.metadata)
+                        metadata = parse_participant_metadata(participant)
                         participant_lang = metadata.get("language", "en")
                         logger.info(f"   - Participant language preference: {participant_lang}")
                     except Exception as e:
@@ -1048,104 +1787,130 @@ DATE HANDLING:
         speech_controller = SynchronizedSpeechController(session, ctx.room)
         logger.info("✅ Speech controller initialized")
         
-        # TEST: Send a test message immediately after session start
-        logger.info("📨 Sending test data message...")
-        try:
-            test_data = json.dumps({
-                "type": "transcription",
-                "speaker": "system",
-                "text": "Agent connected and ready to chat!"
-            }).encode('utf-8')
-            await ctx.room.local_participant.publish_data(test_data, reliable=True)
-            logger.info("✅ Test data message sent successfully!")
-        except Exception as e:
-            logger.error(f"❌ Failed to send test data: {e}")
+        # TEST: Send a test message immediately after session start (debug only,
+        # it delays the greeting by a data-channel round trip)
+        if AGENT_DEBUG_DATAPING:
+            logger.info("📨 Sending test data message...")
+            try:
+                test_data = json_dumps({
+                    "type": "transcription",
+                    "speaker": "system",
+                    "text": "Agent connected and ready to chat!"
+                })
+                await ctx.room.local_participant.publish_data(test_data, reliable=True)
+                logger.info("✅ Test data message sent successfully!")
+            except Exception as e:
+                logger.error(f"❌ Failed to send test data: {e}")
         
         # ADD THESE NEW EVENT HANDLERS for persistence (MUST BE SYNC!)
         # Now that session exists, handlers can access it via closure
         @ctx.room.on("participant_connected")
         def on_participant_connected(participant: rtc.RemoteParticipant):
             """Handle new and returning participants - SYNC callback"""
-            logger.info(f"👤 Participant connected: {participant.identity}")
+            identity = participant.identity
+            logger.info(f"👤 Participant connected: {identity}")
             
             # Check if this is a returning participant
-            if participant.identity in PARTICIPANT_SESSIONS:
+            session_data = PARTICIPANT_SESSIONS.get(identity)
+            if session_data is not None:
                 # They're back!
-                session_data = PARTICIPANT_SESSIONS[participant.identity]
                 reconnect_count = session_data.get('reconnect_count', 0) + 1
                 session_data['reconnect_count'] = reconnect_count
-                session_data['last_seen'] = time.time()
+                session_data['last_seen'] = time.monotonic()
                 
-                logger.info(f"♻️ Welcome back {participant.identity}! Reconnection #{reconnect_count}")
+                logger.info(f"♻️ Welcome back {identity}! Reconnection #{reconnect_count}")
                 
                 # Welcome them back after a short delay
-                if participant.identity not in greeted_participants:
-                    greeted_participants.add(participant.identity)
+                if identity not in greeted_participants:
+                    greeted_participants.add(identity)
                     
                     async def send_welcome_back():
-                        await asyncio.sleep(1.0)  # Wait for data channel to establish
+                        await wait_for_data_channel()
                         
-                        # Get language-specific welcome back message from comprehensive language config
-                        message = get_welcome_back_message(language)
-                        logger.info(f"🗣️ Sending welcome-back message in {language}: {message[:50]}...")
+                        # Language-specific welcome back message, resolved at session start
+                        logger.info(f"🗣️ Sending welcome-back message in {language}: {welcome_back_text[:50]}...")
                         
                         # Use synchronized speech controller
-                        await speech_controller.synchronized_say(message, allow_interruptions=True)
+                        await speech_controller.synchronized_say(welcome_back_text, allow_interruptions=True)
                         logger.info("✅ Welcome-back message sent with synchronization")
                     
                     asyncio.create_task(send_welcome_back())
                 else:
-                    logger.info(f"⚠️ Participant {participant.identity} already in greeted_participants, skipping welcome-back")
+                    logger.info(f"⚠️ Participant {identity} already in greeted_participants, skipping welcome-back")
             else:
                 # New participant
-                PARTICIPANT_SESSIONS[participant.identity] = {
-                    'joined_at': time.time(),
-                    'last_seen': time.time(),
+                now = time.monotonic()
+                PARTICIPANT_SESSIONS[identity] = {
+                    'joined_at': now,
+                    'last_seen': now,
                     'reconnect_count': 0,
                     'language': language
                 }
                 
                 # Send initial greeting only to first participant
-                if len(greeted_participants) == 0 and participant.identity not in greeted_participants:
-                    greeted_participants.add(participant.identity)
+                if not greeted_participants:
+                    greeted_participants.add(identity)
                     
                     async def send_greeting():
-                        await asyncio.sleep(1.0)  # Wait for data channel to establish
+                        await wait_for_data_channel()
                         
-                        # Get language-specific greeting from comprehensive language config
-                        greeting_message = get_greeting(language)
-                        logger.info(f"🗣️ Sending greeting in {language}: {greeting_message[:50]}...")
+                        # Language-specific greeting, resolved at session start
+                        logger.info(f"🗣️ Sending greeting in {language}: {greeting_text[:50]}...")
                         
                         # Use synchronized speech controller
-                        await speech_controller.synchronized_say(greeting_message, allow_interruptions=True)
+                        await speech_controller.synchronized_say(greeting_text, allow_interruptions=True)
                     
                     asyncio.create_task(send_greeting())
         
         @ctx.room.on("participant_disconnected")
         def on_participant_disconnected(participant: rtc.RemoteParticipant):
             """Handle disconnections but keep session data - SYNC callback"""
-            logger.info(f"👤 Participant disconnected: {participant.identity}")
+            identity = participant.identity
+            logger.info(f"👤 Participant disconnected: {identity}")
             
             # Remove from greeted_participants so they get welcomed back on reconnect
-            greeted_participants.discard(participant.identity)
+            greeted_participants.discard(identity)
             
             # Update last seen but DON'T delete the session
-            if participant.identity in PARTICIPANT_SESSIONS:
-                PARTICIPANT_SESSIONS[participant.identity]['last_seen'] = time.time()
-                
-                # Clean up after 5 minutes
-                identity_to_clean = participant.identity
-                
-                async def cleanup_old_session():
-                    await asyncio.sleep(300)  # 5 minutes
-                    if identity_to_clean in PARTICIPANT_SESSIONS:
-                        last_seen = PARTICIPANT_SESSIONS[identity_to_clean]['last_seen']
-                        if time.time() - last_seen > 299:
-                            logger.info(f"🗑️ Cleaning up old session for {identity_to_clean}")
-                            del PARTICIPANT_SESSIONS[identity_to_clean]
-                            greeted_participants.discard(identity_to_clean)
+            session_data = PARTICIPANT_SESSIONS.get(identity)
+            if session_data is not None:
+                now = time.monotonic()
+                session_data['last_seen'] = now
                 
-                asyncio.create_task(cleanup_old_session())
+                # Clean up after 5 minutes (unless they reconnect)
+                heapq.heappush(session_expiry, (now + SESSION_RETENTION_SECONDS, identity))
+                session_expiry_added.set()
+        
+        # One janitor task expires disconnected sessions instead of a sleeping
+        # task per disconnect
+        session_expiry: list[tuple[float, str]] = []
+        session_expiry_added = asyncio.Event()
+        
+        async def expire_old_sessions():
+            while True:
+                if not session_expiry:
+                    session_expiry_added.clear()
+                    await session_expiry_added.wait()
+                    continue
+                deadline, identity = session_expiry[0]
+                now = time.monotonic()
+                if now < deadline:
+                    await asyncio.sleep(deadline - now)
+                    continue
+                heapq.heappop(session_expiry)
+                session_data = PARTICIPANT_SESSIONS.get(identity)
+                # Skip participants who reconnected since this entry was queued
+                if session_data and now - session_data['last_seen'] >= SESSION_RETENTION_SECONDS:
+                    logger.info(f"🗑️ Cleaning up old session for {identity}")
+                    del PARTICIPANT_SESSIONS[identity]
+                    greeted_participants.discard(identity)
+        
+        session_janitor = asyncio.create_task(expire_old_sessions())
+        
+        async def stop_session_janitor():
+            session_janitor.cancel()
+        
+        ctx.add_shutdown_callback(stop_session_janitor)
         
         # Check for existing participants and trigger the connection event
         logger.info("👥 Checking for existing participants...")
@@ -1222,153 +1987,51 @@ DATE HANDLING:
             into the STT-LLM-TTS pipeline, maintaining full conversation context and tool functionality.
             """
             # Log packet structure for documentation
-            logger.info(f"📦 DATA_RECEIVED Packet Structure:")
-            logger.info(f"   - Type: {type(packet)}")
-            logger.info(f"   - Attributes: {[attr for attr in dir(packet) if not attr.startswith('_')]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📦 DATA_RECEIVED Packet Structure:")
+                logger.debug(f"   - Type: {type(packet)}")
+                logger.debug(f"   - Attributes: {[attr for attr in dir(packet) if not attr.startswith('_')]}")
             
             # Extract data and participant from the DataPacket object
             data = packet.data  # bytes containing the JSON payload
             participant = packet.participant  # RemoteParticipant who sent it
             
-            logger.info(f"   - Data length: {len(data)} bytes")
-            logger.info(f"   - Participant: {participant.identity if participant else 'None'}")
-            if hasattr(packet, 'kind'):
-                logger.info(f"   - Kind: {packet.kind}")
-            if hasattr(packet, 'topic'):
-                logger.info(f"   - Topic: {packet.topic}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"   - Data length: {len(data)} bytes")
+                logger.debug(f"   - Participant: {participant.identity if participant else 'None'}")
+                if hasattr(packet, 'kind'):
+                    logger.debug(f"   - Kind: {packet.kind}")
+                if hasattr(packet, 'topic'):
+                    logger.debug(f"   - Topic: {packet.topic}")
+            
+            # Every command the frontend sends is a small JSON object
+            if not data or data[0] != 0x7B:  # b'{'
+                logger.debug("Data received (not a JSON command), ignoring")
+                return
+            if len(data) > MAX_DATA_MESSAGE_BYTES:
+                logger.warning(f"⚠️ Oversized data message ({len(data)} bytes), ignoring")
+                return
             
             try:
-                message = json.loads(data.decode('utf-8'))
-                
-                # Handle config updates
-                if message.get('type') == 'config_update':
-                    if 'interruptions_enabled' in message:
-                        if hasattr(ctx.room, 'speech_controller'):
-                            ctx.room.speech_controller.interruptions_enabled = message['interruptions_enabled']
-                            logger.info(f"🤚 Interruptions {'enabled' if message['interruptions_enabled'] else 'disabled'} by user")
-                
-                # Check if this is test input (not regular transcriptions)
-                elif message.get('type') == 'test_user_input' and message.get('text'):
-                    text = message['text']
-                    participant_id = participant.identity if participant else "unknown"
-                    logger.info(f"🧪 TEST INPUT received from {participant_id}: {text}")
-                    
-                    async def inject_text_input():
-                        try:
-                            logger.info(f"🧪 Using session.generate_reply() to inject text: {text}")
-                            
-                            # Interrupt any ongoing speech
-                            session.interrupt()
-                            
-                            # Send transcription to data channel for UI display
-                            try:
-                                trans_data = json.dumps({
-                                    "type": "transcription",
-                                    "speaker": "user", 
-                                    "text": text
-                                }).encode('utf-8')
-                                await ctx.room.local_participant.publish_data(trans_data, reliable=True)
-                                logger.info("✅ Sent user transcription to data channel")
-                            except Exception as e:
-                                logger.error(f"Error sending transcription: {e}")
-                            
-                            # Inject text as if user spoke it using the official method
-                            speech_handle = await session.generate_reply(
-                                user_input=text,
-                                allow_interruptions=True
-                            )
-                            
-                            logger.info("🧪 Text injected into pipeline, waiting for completion...")
-                            
-                            # Wait for agent to complete response
-                            await speech_handle.wait_for_playout()
-                            
-                            logger.info("🧪 Agent response completed")
-                            
-                        except Exception as e:
-                            logger.error(f"❌ Error injecting text input: {e}")
-                            # Fallback error message
-                            session.say("I'm having trouble processing that request. Please try again.", 
-                                       allow_interruptions=True)
-                    
-                    asyncio.create_task(inject_text_input())
-                
-                # Check for test harness commands
-                elif message.get('type') == 'run_test_harness':
-                    logger.info("🧪 Running automated test harness")
-                    
-                    async def run_automated_tests():
-                        # Add test cases
-                        await test_harness.add_test(
-                            "Find flights from New York to London", 
-                            expected_tool="search_flights"
-                        )
-                        await test_harness.add_test(
-                            "What about morning flights only?",
-                            expected_tool="search_flights"
-                        )
-                        await test_harness.add_test(
-                            "Show me business class options",
-                            expected_tool="search_flights"
-                        )
-                        
-                        # Run all tests
-                        await test_harness.run_tests()
-                    
-                    asyncio.create_task(run_automated_tests())
-                
-                # Handle text display confirmations from frontend
-                elif message.get('type') == 'text_displayed' and message.get('speech_id'):
-                    speech_id = message['speech_id']
-                    logger.info(f"✅ Frontend confirmed text display for speech {speech_id}")
-                    speech_controller.confirm_text_displayed(speech_id)
-                
-                # Handle environment updates from frontend
-                elif message.get('type') == 'environment_update':
-                    new_environment = message.get('environment', 'medium')
-                    logger.info(f"🌍 ENVIRONMENT UPDATE: {new_environment}")
-                    
-                    # Get VAD configs from prewarm
-                    vad_configs = ctx.proc.userdata.get("vad_configs", {})
-                    
-                    if new_environment in vad_configs:
-                        # Reload VAD with new configuration
-                        logger.info(f"🔄 Reloading VAD with {new_environment} settings...")
-                        new_config = vad_configs[new_environment]
-                        
-                        # Log the new settings
-                        logger.info(f"   - min_silence_duration: {new_config['min_silence_duration']}s")
-                        logger.info(f"   - activation_threshold: {new_config['activation_threshold']}")
-                        
-                        # Create new VAD with updated settings
-                        new_vad = silero.VAD.load(**new_config)
-                        
-                        # Update the VAD in the agent session
-                        session._vad = new_vad
-                        
-                        # Store current environment
-                        ctx.proc.userdata["current_environment"] = new_environment
-                        
-                        logger.info(f"✅ VAD updated to {new_environment} environment settings")
-                        
-                        # Send confirmation to chat only (no voice announcement)
-                        confirmation_text = f"Voice detection adjusted for {new_environment} environment."
-                        # Don't announce via voice - just send to chat
-                        confirmation_data = json.dumps({
-                            "type": "system_message",
-                            "speaker": "system",
-                            "text": confirmation_text,
-                            "timestamp": datetime.now().isoformat()
-                        }).encode('utf-8')
-                        asyncio.create_task(ctx.room.local_participant.publish_data(
-                            confirmation_data, 
-                            reliable=True
-                        ))
-                    else:
-                        logger.warning(f"⚠️ Unknown environment: {new_environment}")
-                    
-            except Exception as e:
-                logger.debug(f"Data received (not test input): {e}")
+                message = json_loads(data)
+            except ValueError as e:  # orjson and stdlib JSONDecodeError both subclass it
+                # Lazy %-formatting: the error repr is only built when DEBUG is on
+                logger.debug("Data received (invalid JSON), ignoring: %r", e)
+                return
+            
+            # Unknown types (heartbeats, other tools' traffic) drop out here without any formatting
+            message_type = message.get('type')
+            if not isinstance(message_type, str):
+                return
+            handler = _DATA_MESSAGE_HANDLERS.get(message_type)
+            if handler is None:
+                return
+            try:
+                handler(message, DataChannelContext(ctx, session, speech_controller, test_harness, data_queue, participant))
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                # Missing or wrongly typed fields in a client payload (e.g. a list
+                # speech_id, a non-object batch entry) must not escape the room callback
+                logger.warning(f"Malformed {message_type!r} data message: {e!r}")
         
     except Exception as e:
         logger.error("="*60)
@@ -1428,16 +2091,12 @@ if __name__ == "__main__":
     else:
         logger.info("✅ agent_name not set or empty (good for automatic dispatch)")
     
-    # Log all attributes of options
-    logger.info("📋 WorkerOptions attributes:")
-    for attr in dir(options):
-        if not attr.startswith('_'):
-            try:
-                value = getattr(options, attr)
-                if value is not None:
-                    logger.info(f"   - {attr}: {value}")
-            except:
-                pass
+    # Log the interesting WorkerOptions fields (debug only)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📋 WorkerOptions attributes:")
+        for name in ("entrypoint_fnc", "prewarm_fnc", "ws_url", "port", "host",
+                     "num_idle_processes", "drain_timeout"):
+            logger.debug("   - %s=%r", name, getattr(options, name, None))
     
     logger.info("="*60)
     logger.info("🚀 STARTING AGENT...")
@@ -3,6 +3,10 @@
 Audio utilities for resampling and format conversion
 Fixes sample rate mismatch between TTS (24kHz) and WebRTC (48kHz)
 """
+import functools
+import math
+from typing import Optional
+
 import numpy as np
 from scipy import signal
 from livekit import rtc
@@ -23,20 +27,25 @@ def resample_audio(audio_data: bytes, original_rate: int = 24000, target_rate: i
     Returns:
         Resampled audio bytes (int16 format)
     """
+    # Nothing to do when the rates already match
+    if original_rate == target_rate:
+        return bytes(audio_data)
+    
     # Convert bytes to numpy array
     audio_array = np.frombuffer(audio_data, dtype=np.int16)
     
-    # Convert to float for resampling
-    audio_float = audio_array.astype(np.float32) / 32768.0
-    
-    # Calculate new length
-    new_length = int(len(audio_float) * target_rate / original_rate)
+    # Reduce the rate ratio to the smallest up/down pair
+    ratio_gcd = math.gcd(target_rate, original_rate)
+    up = target_rate // ratio_gcd
+    down = original_rate // ratio_gcd
     
-    # Resample using scipy
-    resampled = signal.resample(audio_float, new_length)
+    # Polyphase FIR resampling instead of the FFT round-trip. The filter has
+    # unity gain, so the raw int16 values go in without normalizing first.
+    resampled = signal.resample_poly(audio_array, up, down, window=('kaiser', 8.0))
     
-    # Convert back to int16
-    resampled_int16 = (resampled * 32767).astype(np.int16)
+    # Convert back to int16 (clip filter overshoot on full-scale input)
+    np.clip(resampled, -32768, 32767, out=resampled)
+    resampled_int16 = resampled.astype(np.int16)
     
     logger.debug(
         f"Resampled audio: {original_rate}Hz → {target_rate}Hz, "
@@ -84,21 +93,24 @@ def chunk_audio_data(audio_data: bytes, chunk_duration_ms: int = 10, sample_rate
     samples_per_chunk = int(sample_rate * chunk_duration_ms / 1000)
     bytes_per_chunk = samples_per_chunk * bytes_per_sample
     
-    chunks = []
-    for i in range(0, len(audio_data), bytes_per_chunk):
-        chunk = audio_data[i:i + bytes_per_chunk]
-        if len(chunk) == bytes_per_chunk:
-            chunks.append(chunk)
-        elif len(chunk) > 0:
-            # Pad the last chunk if needed
-            padding = bytes_per_chunk - len(chunk)
-            chunk += b'\x00' * padding
-            chunks.append(chunk)
+    n_full, remainder = divmod(len(audio_data), bytes_per_chunk)
+    
+    # View the full chunks as rows of one array instead of slicing in a loop
+    arr = np.frombuffer(audio_data, dtype=np.uint8)
+    full = arr[:n_full * bytes_per_chunk].reshape(n_full, bytes_per_chunk)
+    chunks = [row.tobytes() for row in full]
+    
+    if remainder:
+        # Pad the last chunk
+        last = np.zeros(bytes_per_chunk, dtype=np.uint8)
+        last[:remainder] = arr[n_full * bytes_per_chunk:]
+        chunks.append(last.tobytes())
     
     return chunks
 
 
-async def generate_test_tone(
+@functools.lru_cache(maxsize=32)
+def generate_test_tone(
     frequency: float = 440.0,
     duration: float = 1.0,
     sample_rate: int = 48000
@@ -106,6 +118,9 @@ async def generate_test_tone(
     """
     Generate a test tone for audio testing
     
+    Results are cached per (frequency, duration, sample_rate); the returned
+    bytes are immutable so they can be shared between callers.
+    
     Args:
         frequency: Tone frequency in Hz (default 440Hz = A4)
         duration: Duration in seconds
@@ -114,18 +129,29 @@ async def generate_test_tone(
     Returns:
         Audio data as bytes
     """
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    audio_data = np.sin(2 * np.pi * frequency * t)
+    num_samples = int(sample_rate * duration)
     
-    # Apply envelope to avoid clicks
-    envelope = np.ones_like(audio_data)
-    fade_samples = int(0.01 * sample_rate)  # 10ms fade
-    envelope[:fade_samples] = np.linspace(0, 1, fade_samples)
-    envelope[-fade_samples:] = np.linspace(1, 0, fade_samples)
-    audio_data *= envelope
+    # An integer frequency repeats exactly every sample_rate / gcd samples
+    # (1200 samples = 11 cycles for 440Hz at 48kHz): compute that once and tile
+    period = num_samples
+    if float(frequency).is_integer() and frequency > 0:
+        period = min(num_samples, sample_rate // math.gcd(sample_rate, int(frequency)))
+    
+    audio_data = np.arange(period, dtype=np.float32)
+    audio_data *= np.float32(2 * np.pi * frequency / sample_rate)
+    np.sin(audio_data, out=audio_data)
+    if period < num_samples:
+        audio_data = np.resize(audio_data, num_samples)
+    
+    # Fade in/out to avoid clicks (the middle is left untouched)
+    fade_samples = min(int(0.01 * sample_rate), num_samples // 2)  # 10ms fade
+    if fade_samples:
+        audio_data[:fade_samples] *= np.linspace(0, 1, fade_samples, dtype=np.float32)
+        audio_data[-fade_samples:] *= np.linspace(1, 0, fade_samples, dtype=np.float32)
     
     # Convert to int16
-    audio_int16 = (audio_data * 32767).astype(np.int16)
+    audio_data *= 32767
+    audio_int16 = audio_data.astype(np.int16)
     
     logger.info(f"Generated {duration}s test tone at {frequency}Hz, {sample_rate}Hz sample rate")
     
@@ -133,50 +159,137 @@ async def generate_test_tone(
 
 
 class AudioFrameBuffer:
-    """Buffer for accumulating audio data and creating frames"""
+    """Buffer for accumulating audio data and creating frames
+    
+    Samples are kept in a preallocated int16 ring buffer, so adding data and
+    emitting frames copies each sample once instead of reallocating the whole
+    buffer for every frame.
+    
+    With ``max_frame_duration_ms`` set, frames are progressive: the first frame
+    after a flush/clear is ``frame_duration_ms`` long and each following frame
+    doubles up to the maximum, so playback starts early without sending tiny
+    frames for the rest of the utterance.
+    """
     
-    def __init__(self, sample_rate: int = 48000, frame_duration_ms: int = 10):
+    def __init__(self, sample_rate: int = 48000, frame_duration_ms: int = 10,
+                 max_frame_duration_ms: Optional[int] = None):
         self.sample_rate = sample_rate
         self.frame_duration_ms = frame_duration_ms
         self.samples_per_frame = int(sample_rate * frame_duration_ms / 1000)
         self.bytes_per_frame = self.samples_per_frame * 2  # 2 bytes per int16 sample
-        self.buffer = bytearray()
+        self.max_samples_per_frame = max(
+            self.samples_per_frame,
+            int(sample_rate * (max_frame_duration_ms or frame_duration_ms) / 1000)
+        )
+        self._frame_samples = self.samples_per_frame  # Size of the next frame
+        # 16 max-size frames; _write() grows the ring if a chunk doesn't fit
+        self._ring = np.zeros(self.max_samples_per_frame * 16, dtype=np.int16)
+        self._scratch = np.empty(self.max_samples_per_frame, dtype=np.int16)
+        self._head = 0  # Index of the oldest buffered sample
+        self._count = 0  # Number of buffered samples
+        self._tail = b''  # Odd trailing byte of the last chunk (half a sample)
+    
+    def __len__(self) -> int:
+        """Number of buffered bytes"""
+        return self._count * 2
+    
+    def _write(self, samples: np.ndarray):
+        """Append samples to the ring, growing it if it would overflow"""
+        capacity = len(self._ring)
+        if self._count + len(samples) > capacity:
+            # Unroll into a larger ring (rare: only when frames aren't drained)
+            new_capacity = max(capacity * 2, self._count + len(samples))
+            ring = np.zeros(new_capacity, dtype=np.int16)
+            ring[:self._count] = self._read_view(self._count)
+            self._ring, self._head, capacity = ring, 0, new_capacity
+        
+        tail = (self._head + self._count) % capacity
+        first = min(len(samples), capacity - tail)
+        np.copyto(self._ring[tail:tail + first], samples[:first])
+        np.copyto(self._ring[:len(samples) - first], samples[first:])
+        self._count += len(samples)
+    
+    def _read_view(self, n: int) -> np.ndarray:
+        """Return the oldest n samples without consuming them (contiguous copy if wrapped)"""
+        end = self._head + n
+        if end <= len(self._ring):
+            return self._ring[self._head:end]
+        return np.concatenate((self._ring[self._head:], self._ring[:end - len(self._ring)]))
+    
+    def _consume(self, n: int):
+        """Drop the oldest n samples"""
+        self._head = (self._head + n) % len(self._ring)
+        self._count -= n
+        if self._count == 0:
+            self._head = 0
+    
+    def _read_frame(self, n: int) -> bytes:
+        """Remove n samples (one frame) from the ring and return them as bytes"""
+        end = self._head + n
+        if end <= len(self._ring):
+            data = self._ring[self._head:end].tobytes()
+        else:
+            first = len(self._ring) - self._head
+            np.copyto(self._scratch[:first], self._ring[self._head:])
+            np.copyto(self._scratch[first:n], self._ring[:n - first])
+            data = self._scratch[:n].tobytes()
+        self._consume(n)
+        return data
     
     def add_data(self, data: bytes) -> list[rtc.AudioFrame]:
-        """Add audio data to buffer and return complete frames"""
-        self.buffer.extend(data)
+        """Add audio data to buffer and return complete frames
+        
+        Chunks may split a sample; an odd trailing byte is kept and joined with
+        the next chunk instead of failing the int16 conversion.
+        """
+        view = memoryview(data)
+        if self._tail or view.nbytes & 1:
+            data = self._tail + view.tobytes()
+            whole = len(data) & ~1
+            data, self._tail = data[:whole], data[whole:]
+        self._write(np.frombuffer(data, dtype=np.int16))
         frames = []
         
-        while len(self.buffer) >= self.bytes_per_frame:
-            frame_data = bytes(self.buffer[:self.bytes_per_frame])
-            self.buffer = self.buffer[self.bytes_per_frame:]
-            
+        while self._count >= self._frame_samples:
+            n = self._frame_samples
             frame = rtc.AudioFrame(
-                data=frame_data,
+                data=self._read_frame(n),
                 sample_rate=self.sample_rate,
                 num_channels=1,
-                samples_per_channel=self.samples_per_frame
+                samples_per_channel=n
             )
             frames.append(frame)
+            self._frame_samples = min(n * 2, self.max_samples_per_frame)
         
         return frames
     
     def flush(self) -> list[rtc.AudioFrame]:
         """Flush remaining data as a frame (padded if needed)"""
         frames = []
-        if self.buffer:
-            # Pad to frame size
-            padding = self.bytes_per_frame - len(self.buffer)
-            if padding > 0:
-                self.buffer.extend(b'\x00' * padding)
+        if self._count:
+            # Pad to a whole number of base frames
+            n = -(-self._count // self.samples_per_frame) * self.samples_per_frame
+            padded = np.zeros(n, dtype=np.int16)
+            # Copy straight out of the ring (two segments if it wraps) rather
+            # than concatenating the wrapped halves first
+            first = min(self._count, len(self._ring) - self._head)
+            padded[:first] = self._ring[self._head:self._head + first]
+            padded[first:self._count] = self._ring[:self._count - first]
             
             frame = rtc.AudioFrame(
-                data=bytes(self.buffer),
+                data=padded.tobytes(),
                 sample_rate=self.sample_rate,
                 num_channels=1,
-                samples_per_channel=self.samples_per_frame
+                samples_per_channel=n
             )
             frames.append(frame)
-            self.buffer.clear()
+            self.clear()
         
-        return frames
\ No newline at end of file
+        return frames
+    
+    def clear(self):
+        """Drop all buffered audio without reallocating"""
+        self._head = 0
+        self._count = 0
+        self._tail = b''
+        self._frame_samples = self.samples_per_frame
@@ -7,6 +7,7 @@ This module provides comprehensive language support configuration for Deepgram N
 """
 
 from typing import Dict, Optional, Tuple
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
@@ -229,6 +230,7 @@ LANGUAGE_NAMES = {
 }
 
 
+@functools.lru_cache(maxsize=256)
 def get_deepgram_config(language_code: str, is_codeswitching: bool = False) -> Optional[Dict[str, str]]:
     """
     Get the optimal Deepgram model and language configuration.
@@ -284,6 +286,7 @@ def is_language_supported(language_code: str) -> bool:
     return config is not None
 
 
+@functools.lru_cache(maxsize=256)
 def get_language_name(language_code: str) -> str:
     """
     Get the human-readable name for a language code.
@@ -474,6 +477,7 @@ FLIGHT_ASSISTANT_GREETINGS = {
 }
 
 
+@functools.lru_cache(maxsize=256)
 def get_greeting(language_code: str) -> str:
     """
     Get the appropriate greeting for a given language.
@@ -610,6 +614,7 @@ FLIGHT_ASSISTANT_WELCOME_BACK = {
 }
 
 
+@functools.lru_cache(maxsize=256)
 def get_welcome_back_message(language_code: str) -> str:
     """
     Get the appropriate welcome back message for a given language.
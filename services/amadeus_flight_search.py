@@ -3,15 +3,113 @@ Amadeus Flight Search Integration
 Replaces failing AviationStack and SerpAPI with more reliable Amadeus API
 """
 
+import asyncio
+import copy
 import os
-import json
 import logging
+import re
+import time
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from datetime import date
+from urllib.parse import urlencode
 import httpx
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional - fall back to the stdlib decoder
+    from json import loads as json_loads
+
+try:
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Formatted search results are reused for identical queries within this window
+_CACHE_TTL = 60.0  # seconds
+_CACHE_MAX_ENTRIES = 256
+
+# ISO 8601 duration as returned by Amadeus, e.g. PT2H30M
+_ISO8601_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?')
+
+
+def _iso_minutes(dt_str: str) -> int:
+    """Minutes since 0001-01-01 for a fixed-width YYYY-MM-DDTHH:MM[:SS] timestamp"""
+    day = date(int(dt_str[0:4]), int(dt_str[5:7]), int(dt_str[8:10])).toordinal()
+    return day * 1440 + int(dt_str[11:13]) * 60 + int(dt_str[14:16])
+
+# Airline names by IATA code
+_CARRIER_NAMES = {
+    "AA": "American Airlines",
+    "DL": "Delta Air Lines",
+    "UA": "United Airlines",
+    "WN": "Southwest Airlines",
+    "B6": "JetBlue Airways",
+    "AS": "Alaska Airlines",
+    "NK": "Spirit Airlines",
+    "F9": "Frontier Airlines",
+    "G4": "Allegiant Air",
+    "SY": "Sun Country Airlines",
+    "BA": "British Airways",
+    "LH": "Lufthansa",
+    "AF": "Air France",
+    "KL": "KLM",
+    "IB": "Iberia",
+    "LX": "Swiss International",
+    "AZ": "Alitalia",
+    "EW": "Eurowings",
+    "FR": "Ryanair",
+    "U2": "easyJet",
+    "EI": "Aer Lingus",
+    "TP": "TAP Air Portugal",
+    "SN": "Brussels Airlines",
+    "LO": "LOT Polish Airlines",
+    "OK": "Czech Airlines",
+    "RO": "TAROM",
+    "JU": "Air Serbia",
+    "A3": "Aegean Airlines",
+    "TK": "Turkish Airlines",
+    "SU": "Aeroflot",
+    "EK": "Emirates",
+    "QR": "Qatar Airways",
+    "EY": "Etihad Airways",
+    "SQ": "Singapore Airlines",
+    "CX": "Cathay Pacific",
+    "NH": "All Nippon Airways",
+    "JL": "Japan Airlines",
+    "KE": "Korean Air",
+    "OZ": "Asiana Airlines",
+    "CA": "Air China",
+    "MU": "China Eastern",
+    "CZ": "China Southern",
+    "AI": "Air India",
+    "6E": "IndiGo",
+    "SG": "SpiceJet",
+    "QF": "Qantas",
+    "VA": "Virgin Australia",
+    "NZ": "Air New Zealand",
+    "AC": "Air Canada",
+    "WS": "WestJet",
+    "AM": "Aeroméxico",
+    "CM": "Copa Airlines",
+    "AV": "Avianca",
+    "LA": "LATAM Airlines",
+    "AR": "Aerolíneas Argentinas",
+    "G3": "Gol Linhas Aéreas",
+    "AD": "Azul Brazilian Airlines",
+    "ET": "Ethiopian Airlines",
+    "MS": "EgyptAir",
+    "SA": "South African Airways",
+    "KQ": "Kenya Airways",
+    "RJ": "Royal Jordanian"
+}
+
+# Major US network/low-cost carriers, for the search summary
+_US_MAJORS = frozenset({"AA", "DL", "UA", "WN", "B6", "AS"})
+
 class AmadeusFlightSearch:
     """Flight search using Amadeus API with proper authentication"""
     
@@ -22,45 +120,71 @@ class AmadeusFlightSearch:
         amadeus_base = os.getenv("AMADEUS_BASE_URL", "api.amadeus.com")
         self.base_url = f"https://{amadeus_base}/v2"
         self.auth_url = f"https://{amadeus_base}/v1/security/oauth2/token"
-        self.http_client = httpx.AsyncClient(timeout=30.0)
+        # Credentials never change, so form-encode the token request body once
+        self._auth_body = urlencode({
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }).encode("ascii")
+        self._auth_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        # Pooled keep-alive client; with HTTP/2 concurrent searches share one
+        # TLS connection to Amadeus
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60.0),
+            headers={"Accept": "application/json"}
+        )
         self.access_token = None
-        self.token_expiry = None
+        self.token_expiry = 0.0  # time.monotonic() deadline
+        # Concurrent searches on a cold/expired token share one refresh
+        self._token_lock = asyncio.Lock()
+        # (normalized query) -> (time.monotonic() when cached, results), oldest first
+        self._cache: OrderedDict[tuple, tuple[float, List[Dict[str, Any]]]] = OrderedDict()
+    
+    async def __aenter__(self) -> "AmadeusFlightSearch":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def close(self):
+        """Close HTTP client"""
+        await self.http_client.aclose()
         
     async def _get_access_token(self) -> str:
         """Get or refresh Amadeus access token"""
         # Check if we have a valid token
-        if self.access_token and self.token_expiry and datetime.now() < self.token_expiry:
+        if self.access_token and time.monotonic() < self.token_expiry:
             return self.access_token
             
-        # Get new token
-        try:
-            data = {
-                "grant_type": "client_credentials",
-                "client_id": self.client_id,
-                "client_secret": self.client_secret
-            }
-            
-            response = await self.http_client.post(
-                self.auth_url,
-                data=data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
+        async with self._token_lock:
+            # Another caller may have refreshed it while we waited
+            if self.access_token and time.monotonic() < self.token_expiry:
+                return self.access_token
             
-            if response.status_code == 200:
-                token_data = response.json()
+            # Get new token
+            try:
+                response = await self.http_client.post(
+                    self.auth_url,
+                    content=self._auth_body,
+                    headers=self._auth_headers
+                )
+                
+                # Non-2xx raises httpx.HTTPStatusError, logged and re-raised below
+                response.raise_for_status()
+                
+                token_data = json_loads(response.content)
                 self.access_token = token_data["access_token"]
-                # Token expires in seconds, convert to datetime
+                # Token expires in seconds; track it on the monotonic clock
                 expires_in = token_data.get("expires_in", 1799)  # Default 30 min
-                self.token_expiry = datetime.now() + timedelta(seconds=expires_in - 60)  # Refresh 1 min early
+                self.token_expiry = time.monotonic() + expires_in - 60  # Refresh 1 min early
                 logger.info("Amadeus token obtained successfully")
                 return self.access_token
-            else:
-                logger.error(f"Failed to get Amadeus token: {response.status_code} - {response.text}")
-                raise Exception(f"Amadeus authentication failed: {response.status_code}")
                 
-        except Exception as e:
-            logger.error(f"Error getting Amadeus token: {e}")
-            raise
+            except Exception as e:
+                logger.error(f"Error getting Amadeus token: {e}")
+                raise
     
     async def search_flights(
         self,
@@ -75,14 +199,30 @@ class AmadeusFlightSearch:
         max_results: int = 10
     ) -> List[Dict[str, Any]]:
         """Search flights using Amadeus API"""
+        # Normalize once; the cache key and the request params share these.
+        # Tool calls usually pass codes uppercase already, so skip the copy then
+        if not origin.isupper():
+            origin = origin.upper()
+        if not destination.isupper():
+            destination = destination.upper()
+        if not travel_class.isupper():
+            travel_class = travel_class.upper()
+        key = (origin, destination, departure_date, return_date,
+               adults, children, travel_class, currency, max_results)
+        cached_at, cached = self._cache.get(key, (0.0, None))
+        if cached is not None and time.monotonic() - cached_at < _CACHE_TTL:
+            logger.info("Using cached Amadeus results for %s", key)
+            # Callers annotate flights in place; never hand out the cached dicts
+            return copy.deepcopy(cached)
+        
         try:
             # Get access token
             token = await self._get_access_token()
             
             # Build request parameters
             params = {
-                "originLocationCode": origin.upper(),
-                "destinationLocationCode": destination.upper(),
+                "originLocationCode": origin,
+                "destinationLocationCode": destination,
                 "departureDate": departure_date,
                 "adults": adults,
                 "currencyCode": currency,
@@ -95,17 +235,14 @@ class AmadeusFlightSearch:
             if children > 0:
                 params["children"] = children
             if travel_class != "ECONOMY":
-                params["travelClass"] = travel_class.upper()
+                params["travelClass"] = travel_class
             
             # Add non-stop filter if looking for direct flights
             params["nonStop"] = "false"  # Include both direct and connecting flights
             params["max"] = 50  # Get more results to find direct flights
             
             # Make API request
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/json"
-            }
+            headers = {"Authorization": f"Bearer {token}"}
             
             response = await self.http_client.get(
                 f"{self.base_url}/shopping/flight-offers",
@@ -113,27 +250,41 @@ class AmadeusFlightSearch:
                 headers=headers
             )
             
-            if response.status_code == 200:
-                data = response.json()
-                results = self._format_amadeus_results(data)
-                
-                # Log airlines found
-                airlines = set(f["airline_code"] for f in results)
-                logger.info(f"Airlines found: {airlines}")
-                
-                # Check for direct flights
-                direct_flights = [f for f in results if f.get("stops", 0) == 0]
-                logger.info(f"Direct flights found: {len(direct_flights)}")
-                
-                # Check for American Airlines
-                aa_flights = [f for f in results if f.get("airline_code") == "AA"]
-                logger.info(f"American Airlines flights found: {len(aa_flights)}")
-                
-                return results
-            else:
+            if response.status_code != 200:
                 logger.error(f"Amadeus search failed: {response.status_code} - {response.text}")
                 # Return empty list to fall back to mock data
                 return []
+            
+            # Decode the raw bytes with orjson (httpx's .json() uses stdlib json)
+            data = json_loads(response.content)
+            results = self._format_amadeus_results(data)
+            
+            # The summary is log-only, so skip the pass entirely when INFO is filtered out
+            if logger.isEnabledFor(logging.INFO):
+                # Airlines, direct flights, American Airlines and US major flights in one pass
+                airlines = set()
+                direct_count = 0
+                aa_count = 0
+                us_major_count = 0
+                for f in results:
+                    airline_code = f["airline_code"]
+                    airlines.add(airline_code)
+                    direct_count += f.get("stops", 0) == 0
+                    aa_count += airline_code == "AA"
+                    us_major_count += airline_code in _US_MAJORS
+                logger.info("Airlines found: %s", airlines)
+                logger.info("Direct flights found: %d", direct_count)
+                logger.info("American Airlines flights found: %d", aa_count)
+                logger.info("US major carrier flights found: %d", us_major_count)
+            
+            # Cache non-empty results (empty means nothing to reuse), evicting the oldest
+            if results:
+                self._cache.pop(key, None)
+                self._cache[key] = (time.monotonic(), copy.deepcopy(results))
+                if len(self._cache) > _CACHE_MAX_ENTRIES:
+                    self._cache.popitem(last=False)
+            
+            return results
                 
         except Exception as e:
             logger.error(f"Error searching Amadeus flights: {e}")
@@ -174,33 +325,28 @@ class AmadeusFlightSearch:
                     "currency": offer["price"]["currency"],
                     "price_formatted": f"{offer['price']['currency']} {offer['price']['total']}",
                     "stops": len(segments) - 1,
-                    "segments": []
+                    "segments": [
+                        {
+                            "carrier": seg["carrierCode"],
+                            "flight_number": f"{seg['carrierCode']}{seg['number']}",
+                            "departure": seg["departure"]["iataCode"],
+                            "departure_time": self._format_datetime(seg["departure"]["at"]),
+                            "arrival": seg["arrival"]["iataCode"],
+                            "arrival_time": self._format_datetime(seg["arrival"]["at"]),
+                            "duration": self._parse_duration(seg.get("duration", "PT0H")),
+                            "aircraft": (seg.get("aircraft") or {}).get("code", "")
+                        }
+                        for seg in segments
+                    ]
                 }
                 
-                # Add segment details
-                for seg in segments:
-                    flight["segments"].append({
-                        "carrier": seg["carrierCode"],
-                        "flight_number": f"{seg['carrierCode']}{seg['number']}",
-                        "departure": seg["departure"]["iataCode"],
-                        "departure_time": self._format_datetime(seg["departure"]["at"]),
-                        "arrival": seg["arrival"]["iataCode"],
-                        "arrival_time": self._format_datetime(seg["arrival"]["at"]),
-                        "duration": self._parse_duration(seg.get("duration", "PT0H")),
-                        "aircraft": seg.get("aircraft", {}).get("code", "")
-                    })
-                
                 # Add layover info if applicable
                 if len(segments) > 1:
-                    layovers = []
-                    for i in range(len(segments) - 1):
-                        layover_airport = segments[i]["arrival"]["iataCode"]
-                        layover_duration = self._calculate_layover_duration(
-                            segments[i]["arrival"]["at"],
-                            segments[i + 1]["departure"]["at"]
-                        )
-                        layovers.append(f"{layover_airport} ({layover_duration})")
-                    flight["layovers"] = ", ".join(layovers)
+                    flight["layovers"] = ", ".join(
+                        f"{arriving['arrival']['iataCode']} "
+                        f"({self._calculate_layover_duration(arriving['arrival']['at'], departing['departure']['at'])})"
+                        for arriving, departing in zip(segments, segments[1:])
+                    )
                 
                 # Add cabin class
                 if offer.get("travelerPricings"):
@@ -216,14 +362,11 @@ class AmadeusFlightSearch:
     
     def _parse_duration(self, duration_str: str) -> int:
         """Parse ISO 8601 duration to minutes"""
-        import re
-        # Example: PT2H30M
-        match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?', duration_str)
-        if match:
-            hours = int(match.group(1) or 0)
-            minutes = int(match.group(2) or 0)
-            return hours * 60 + minutes
-        return 0
+        match = _ISO8601_DURATION_RE.match(duration_str)
+        if not match:
+            return 0
+        hours, minutes = match.groups()
+        return (int(hours) if hours else 0) * 60 + (int(minutes) if minutes else 0)
     
     def _format_duration(self, minutes: int) -> str:
         """Format minutes to readable duration"""
@@ -238,91 +381,22 @@ class AmadeusFlightSearch:
     
     def _format_datetime(self, dt_str: str) -> str:
         """Format datetime string to readable format"""
-        try:
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            return dt.strftime("%H:%M")
-        except:
-            return dt_str
+        # Amadeus times are fixed-width YYYY-MM-DDTHH:MM:SS, so HH:MM is a slice
+        if len(dt_str) >= 16 and dt_str[10] == 'T':
+            return dt_str[11:16]
+        return dt_str
     
     def _calculate_layover_duration(self, arrival_time: str, departure_time: str) -> str:
         """Calculate layover duration between flights"""
         try:
-            arrival = datetime.fromisoformat(arrival_time.replace('Z', '+00:00'))
-            departure = datetime.fromisoformat(departure_time.replace('Z', '+00:00'))
-            duration = departure - arrival
-            hours = int(duration.total_seconds() // 3600)
-            minutes = int((duration.total_seconds() % 3600) // 60)
+            hours, minutes = divmod(_iso_minutes(departure_time) - _iso_minutes(arrival_time), 60)
             return f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
-        except:
+        except (ValueError, TypeError):
             return ""
     
     def _get_carrier_name(self, code: str) -> str:
         """Get airline name from IATA code"""
-        carriers = {
-            "AA": "American Airlines",
-            "DL": "Delta Air Lines",
-            "UA": "United Airlines",
-            "WN": "Southwest Airlines",
-            "B6": "JetBlue Airways",
-            "AS": "Alaska Airlines",
-            "NK": "Spirit Airlines",
-            "F9": "Frontier Airlines",
-            "G4": "Allegiant Air",
-            "SY": "Sun Country Airlines",
-            "BA": "British Airways",
-            "LH": "Lufthansa",
-            "AF": "Air France",
-            "KL": "KLM",
-            "IB": "Iberia",
-            "LX": "Swiss International",
-            "AZ": "Alitalia",
-            "EW": "Eurowings",
-            "FR": "Ryanair",
-            "U2": "easyJet",
-            "EI": "Aer Lingus",
-            "TP": "TAP Air Portugal",
-            "SN": "Brussels Airlines",
-            "LO": "LOT Polish Airlines",
-            "OK": "Czech Airlines",
-            "RO": "TAROM",
-            "JU": "Air Serbia",
-            "A3": "Aegean Airlines",
-            "TK": "Turkish Airlines",
-            "SU": "Aeroflot",
-            "EK": "Emirates",
-            "QR": "Qatar Airways",
-            "EY": "Etihad Airways",
-            "SQ": "Singapore Airlines",
-            "CX": "Cathay Pacific",
-            "NH": "All Nippon Airways",
-            "JL": "Japan Airlines",
-            "KE": "Korean Air",
-            "OZ": "Asiana Airlines",
-            "CA": "Air China",
-            "MU": "China Eastern",
-            "CZ": "China Southern",
-            "AI": "Air India",
-            "6E": "IndiGo",
-            "SG": "SpiceJet",
-            "QF": "Qantas",
-            "VA": "Virgin Australia",
-            "NZ": "Air New Zealand",
-            "AC": "Air Canada",
-            "WS": "WestJet",
-            "AM": "Aeroméxico",
-            "CM": "Copa Airlines",
-            "AV": "Avianca",
-            "LA": "LATAM Airlines",
-            "AR": "Aerolíneas Argentinas",
-            "G3": "Gol Linhas Aéreas",
-            "AD": "Azul Brazilian Airlines",
-            "ET": "Ethiopian Airlines",
-            "MS": "EgyptAir",
-            "SA": "South African Airways",
-            "KQ": "Kenya Airways",
-            "RJ": "Royal Jordanian"
-        }
-        return carriers.get(code, code)
+        return _CARRIER_NAMES.get(code, code)
     
     def _get_airport_name(self, code: str) -> str:
         """Get airport name from IATA code"""
@@ -2,15 +2,101 @@
 Amadeus Flight Search using Official SDK
 """
 
+import copy
 import os
 import logging
+import re
+import time
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
-from datetime import datetime
+from datetime import date
 from amadeus import Client, ResponseError
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
+# Formatted search results are reused for identical queries within these windows;
+# empty results are kept briefly so a dead route doesn't hit the API every turn
+_CACHE_TTL = 120.0  # seconds
+_EMPTY_CACHE_TTL = 30.0  # seconds
+_CACHE_MAX_ENTRIES = 256
+
+# ISO 8601 duration as returned by Amadeus, e.g. PT2H30M
+_ISO8601_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?')
+
+
+def _iso_minutes(dt_str: str) -> int:
+    """Minutes since 0001-01-01 for a fixed-width YYYY-MM-DDTHH:MM[:SS] timestamp"""
+    day = date(int(dt_str[0:4]), int(dt_str[5:7]), int(dt_str[8:10])).toordinal()
+    return day * 1440 + int(dt_str[11:13]) * 60 + int(dt_str[14:16])
+
+# Airline names by IATA code
+_CARRIER_NAMES = {
+    "AA": "American Airlines",
+    "DL": "Delta Air Lines",
+    "DA": "Delta Air Lines",  # Alternative code
+    "UA": "United Airlines",
+    "WN": "Southwest Airlines",
+    "B6": "JetBlue Airways",
+    "AS": "Alaska Airlines",
+    "NK": "Spirit Airlines",
+    "F9": "Frontier Airlines",
+    "G4": "Allegiant Air",
+    "SY": "Sun Country Airlines",
+    "BA": "British Airways",
+    "LH": "Lufthansa",
+    "AF": "Air France",
+    "KL": "KLM",
+    "IB": "Iberia",
+    "LX": "Swiss International",
+    "AZ": "Alitalia",
+    "EW": "Eurowings",
+    "FR": "Ryanair",
+    "U2": "easyJet",
+    "EI": "Aer Lingus",
+    "TP": "TAP Air Portugal",
+    "SN": "Brussels Airlines",
+    "LO": "LOT Polish Airlines",
+    "OK": "Czech Airlines",
+    "RO": "TAROM",
+    "JU": "Air Serbia",
+    "A3": "Aegean Airlines",
+    "TK": "Turkish Airlines",
+    "SU": "Aeroflot",
+    "EK": "Emirates",
+    "QR": "Qatar Airways",
+    "EY": "Etihad Airways",
+    "SQ": "Singapore Airlines",
+    "CX": "Cathay Pacific",
+    "NH": "All Nippon Airways",
+    "JL": "Japan Airlines",
+    "KE": "Korean Air",
+    "OZ": "Asiana Airlines",
+    "CA": "Air China",
+    "MU": "China Eastern",
+    "CZ": "China Southern",
+    "AI": "Air India",
+    "6E": "IndiGo",
+    "SG": "SpiceJet",
+    "QF": "Qantas",
+    "VA": "Virgin Australia",
+    "NZ": "Air New Zealand",
+    "AC": "Air Canada",
+    "WS": "WestJet",
+    "AM": "Aeroméxico",
+    "CM": "Copa Airlines",
+    "AV": "Avianca",
+    "LA": "LATAM Airlines",
+    "AR": "Aerolíneas Argentinas",
+    "G3": "Gol Linhas Aéreas",
+    "AD": "Azul Brazilian Airlines",
+    "ET": "Ethiopian Airlines",
+    "MS": "EgyptAir",
+    "SA": "South African Airways",
+    "KQ": "Kenya Airways",
+    "RJ": "Royal Jordanian"
+}
+
 class AmadeusSDKFlightSearch:
     """Flight search using official Amadeus Python SDK"""
     
@@ -23,6 +109,8 @@ class AmadeusSDKFlightSearch:
             client_secret=os.getenv("AMADEUS_CLIENT_SECRET"),
             hostname='production'  # Use production environment
         )
+        # (normalized query) -> (time.monotonic() expiry, results), oldest first
+        self._cache: OrderedDict[tuple, tuple[float, List[Dict[str, Any]]]] = OrderedDict()
         
     async def search_flights(
         self,
@@ -38,6 +126,14 @@ class AmadeusSDKFlightSearch:
         nonstop: bool = False
     ) -> List[Dict[str, Any]]:
         """Search flights using Amadeus SDK"""
+        key = (origin.upper(), destination.upper(), departure_date, return_date,
+               adults, children, travel_class.upper(), currency, max_results, nonstop)
+        expires_at, cached = self._cache.get(key, (0.0, None))
+        if cached is not None and time.monotonic() < expires_at:
+            logger.info("Using cached Amadeus results for %s", key)
+            # Callers annotate flights in place; never hand out the cached dicts
+            return copy.deepcopy(cached)
+        
         try:
             logger.info(f"Searching flights: {origin} -> {destination} on {departure_date}")
             
@@ -83,6 +179,12 @@ class AmadeusSDKFlightSearch:
             logger.info(f"Direct flights: {len(direct_flights)}")
             logger.info(f"Airlines: {', '.join(sorted(airlines))}")
             
+            # Only successful searches are cached; errors below retry on the next call
+            self._cache.pop(key, None)
+            self._cache[key] = (time.monotonic() + (_CACHE_TTL if results else _EMPTY_CACHE_TTL), copy.deepcopy(results))
+            if len(self._cache) > _CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+            
             return results
             
         except ResponseError as error:
@@ -95,87 +197,91 @@ class AmadeusSDKFlightSearch:
     
     def _format_sdk_results(self, offers: List[Any]) -> List[Dict[str, Any]]:
         """Format SDK results into standard format"""
-        flights = []
+        # Limit results; malformed offers come back as None and are dropped
+        return [flight for flight in map(self._offer_to_flight, offers[:50]) if flight is not None]
+    
+    def _offer_to_flight(self, offer: Any) -> Optional[Dict[str, Any]]:
+        """Format a single SDK offer, or None if it is malformed"""
+        # Bound once per offer instead of an attribute lookup per field/segment
+        fmt_dt = self._format_datetime
+        parse_dur = self._parse_duration
+        airport_name = self._get_airport_name
         
         try:
-            for offer in offers[:50]:  # Limit results
-                # Get first itinerary
-                itinerary = offer['itineraries'][0]
-                segments = itinerary['segments']
-                
-                # Build flight info
-                first_segment = segments[0]
-                last_segment = segments[-1]
-                
-                # Parse duration
-                duration_minutes = self._parse_duration(itinerary.get('duration', 'PT0H'))
-                
-                flight = {
-                    "id": offer['id'],
-                    "airline": self._get_carrier_name(first_segment['carrierCode']),
-                    "airline_code": first_segment['carrierCode'],
-                    "flight_number": f"{first_segment['carrierCode']}{first_segment['number']}",
-                    "departure_time": self._format_datetime(first_segment['departure']['at']),
-                    "departure_airport": f"{self._get_airport_name(first_segment['departure']['iataCode'])} ({first_segment['departure']['iataCode']})",
-                    "departure_terminal": first_segment['departure'].get('terminal', ''),
-                    "arrival_time": self._format_datetime(last_segment['arrival']['at']),
-                    "arrival_airport": f"{self._get_airport_name(last_segment['arrival']['iataCode'])} ({last_segment['arrival']['iataCode']})",
-                    "arrival_terminal": last_segment['arrival'].get('terminal', ''),
-                    "duration": self._format_duration(duration_minutes),
-                    "duration_minutes": duration_minutes,
-                    "price": float(offer['price']['total']),
-                    "currency": offer['price']['currency'],
-                    "price_formatted": f"{offer['price']['currency']} {offer['price']['total']}",
-                    "stops": len(segments) - 1,
-                    "segments": []
-                }
-                
-                # Add segment details
-                for seg in segments:
-                    flight["segments"].append({
+            # Get first itinerary
+            itinerary = offer['itineraries'][0]
+            segments = itinerary['segments']
+            
+            # Build flight info
+            first_segment = segments[0]
+            last_segment = segments[-1]
+            first_departure = first_segment['departure']
+            last_arrival = last_segment['arrival']
+            carrier_code = first_segment['carrierCode']
+            price = offer['price']
+            
+            # Parse duration
+            duration_minutes = parse_dur(itinerary.get('duration', 'PT0H'))
+            
+            flight = {
+                "id": offer['id'],
+                "airline": self._get_carrier_name(carrier_code),
+                "airline_code": carrier_code,
+                "flight_number": f"{carrier_code}{first_segment['number']}",
+                "departure_time": fmt_dt(first_departure['at']),
+                "departure_airport": f"{airport_name(first_departure['iataCode'])} ({first_departure['iataCode']})",
+                "departure_terminal": first_departure.get('terminal', ''),
+                "arrival_time": fmt_dt(last_arrival['at']),
+                "arrival_airport": f"{airport_name(last_arrival['iataCode'])} ({last_arrival['iataCode']})",
+                "arrival_terminal": last_arrival.get('terminal', ''),
+                "duration": self._format_duration(duration_minutes),
+                "duration_minutes": duration_minutes,
+                "price": float(price['total']),
+                "currency": price['currency'],
+                "price_formatted": f"{price['currency']} {price['total']}",
+                "stops": len(segments) - 1,
+                "segments": [
+                    {
                         "carrier": seg['carrierCode'],
                         "flight_number": f"{seg['carrierCode']}{seg['number']}",
                         "departure": seg['departure']['iataCode'],
-                        "departure_time": self._format_datetime(seg['departure']['at']),
+                        "departure_time": fmt_dt(seg['departure']['at']),
                         "arrival": seg['arrival']['iataCode'],
-                        "arrival_time": self._format_datetime(seg['arrival']['at']),
-                        "duration": self._parse_duration(seg.get('duration', 'PT0H')),
-                        "aircraft": seg.get('aircraft', {}).get('code', '')
-                    })
-                
-                # Add layover info
-                if len(segments) > 1:
-                    layovers = []
-                    for i in range(len(segments) - 1):
-                        layover_airport = segments[i]['arrival']['iataCode']
-                        layover_duration = self._calculate_layover_duration(
-                            segments[i]['arrival']['at'],
-                            segments[i + 1]['departure']['at']
-                        )
-                        layovers.append(f"{layover_airport} ({layover_duration})")
-                    flight["layovers"] = ", ".join(layovers)
-                
-                # Add cabin class
-                if offer.get('travelerPricings'):
-                    cabin = offer['travelerPricings'][0]['fareDetailsBySegment'][0].get('cabin', 'ECONOMY')
-                    flight["cabin_class"] = cabin
-                
-                flights.append(flight)
-                
+                        "arrival_time": fmt_dt(seg['arrival']['at']),
+                        "duration": parse_dur(seg.get('duration', 'PT0H')),
+                        "aircraft": (seg.get('aircraft') or {}).get('code', '')
+                    }
+                    for seg in segments
+                ]
+            }
+            
+            # Add layover info
+            if len(segments) > 1:
+                layover = self._calculate_layover_duration
+                flight["layovers"] = ", ".join(
+                    f"{arriving['arrival']['iataCode']} "
+                    f"({layover(arriving['arrival']['at'], departing['departure']['at'])})"
+                    for arriving, departing in zip(segments, segments[1:])
+                )
+            
+            # Add cabin class
+            if offer.get('travelerPricings'):
+                cabin = offer['travelerPricings'][0]['fareDetailsBySegment'][0].get('cabin', 'ECONOMY')
+                flight["cabin_class"] = cabin
+            
+            return flight
+            
         except Exception as e:
             logger.error(f"Error formatting SDK results: {e}")
-        
-        return flights
+            return None
     
     def _parse_duration(self, duration_str: str) -> int:
         """Parse ISO 8601 duration to minutes"""
-        import re
-        match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?', duration_str)
-        if match:
-            hours = int(match.group(1) or 0)
-            minutes = int(match.group(2) or 0)
-            return hours * 60 + minutes
-        return 0
+        match = _ISO8601_DURATION_RE.match(duration_str)
+        if not match:
+            return 0
+        hours, minutes = match.groups()
+        return (int(hours) if hours else 0) * 60 + (int(minutes) if minutes else 0)
     
     def _format_duration(self, minutes: int) -> str:
         """Format minutes to readable duration"""
@@ -190,92 +296,22 @@ class AmadeusSDKFlightSearch:
     
     def _format_datetime(self, dt_str: str) -> str:
         """Format datetime string to readable format"""
-        try:
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            return dt.strftime("%H:%M")
-        except:
-            return dt_str
+        # Amadeus times are fixed-width YYYY-MM-DDTHH:MM:SS, so HH:MM is a slice
+        if len(dt_str) >= 16 and dt_str[10] == 'T':
+            return dt_str[11:16]
+        return dt_str
     
     def _calculate_layover_duration(self, arrival_time: str, departure_time: str) -> str:
         """Calculate layover duration between flights"""
         try:
-            arrival = datetime.fromisoformat(arrival_time.replace('Z', '+00:00'))
-            departure = datetime.fromisoformat(departure_time.replace('Z', '+00:00'))
-            duration = departure - arrival
-            hours = int(duration.total_seconds() // 3600)
-            minutes = int((duration.total_seconds() % 3600) // 60)
+            hours, minutes = divmod(_iso_minutes(departure_time) - _iso_minutes(arrival_time), 60)
             return f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
-        except:
+        except (ValueError, TypeError):
             return ""
     
     def _get_carrier_name(self, code: str) -> str:
         """Get airline name from IATA code"""
-        carriers = {
-            "AA": "American Airlines",
-            "DL": "Delta Air Lines",
-            "DA": "Delta Air Lines",  # Alternative code
-            "UA": "United Airlines",
-            "WN": "Southwest Airlines",
-            "B6": "JetBlue Airways",
-            "AS": "Alaska Airlines",
-            "NK": "Spirit Airlines",
-            "F9": "Frontier Airlines",
-            "G4": "Allegiant Air",
-            "SY": "Sun Country Airlines",
-            "BA": "British Airways",
-            "LH": "Lufthansa",
-            "AF": "Air France",
-            "KL": "KLM",
-            "IB": "Iberia",
-            "LX": "Swiss International",
-            "AZ": "Alitalia",
-            "EW": "Eurowings",
-            "FR": "Ryanair",
-            "U2": "easyJet",
-            "EI": "Aer Lingus",
-            "TP": "TAP Air Portugal",
-            "SN": "Brussels Airlines",
-            "LO": "LOT Polish Airlines",
-            "OK": "Czech Airlines",
-            "RO": "TAROM",
-            "JU": "Air Serbia",
-            "A3": "Aegean Airlines",
-            "TK": "Turkish Airlines",
-            "SU": "Aeroflot",
-            "EK": "Emirates",
-            "QR": "Qatar Airways",
-            "EY": "Etihad Airways",
-            "SQ": "Singapore Airlines",
-            "CX": "Cathay Pacific",
-            "NH": "All Nippon Airways",
-            "JL": "Japan Airlines",
-            "KE": "Korean Air",
-            "OZ": "Asiana Airlines",
-            "CA": "Air China",
-            "MU": "China Eastern",
-            "CZ": "China Southern",
-            "AI": "Air India",
-            "6E": "IndiGo",
-            "SG": "SpiceJet",
-            "QF": "Qantas",
-            "VA": "Virgin Australia",
-            "NZ": "Air New Zealand",
-            "AC": "Air Canada",
-            "WS": "WestJet",
-            "AM": "Aeroméxico",
-            "CM": "Copa Airlines",
-            "AV": "Avianca",
-            "LA": "LATAM Airlines",
-            "AR": "Aerolíneas Argentinas",
-            "G3": "Gol Linhas Aéreas",
-            "AD": "Azul Brazilian Airlines",
-            "ET": "Ethiopian Airlines",
-            "MS": "EgyptAir",
-            "SA": "South African Airways",
-            "KQ": "Kenya Airways",
-            "RJ": "Royal Jordanian"
-        }
-        return carriers.get(code, code)
+        return _CARRIER_NAMES.get(code, code)
     
     def _get_airport_name(self, code: str) -> str:
         """Get airport name from IATA code"""
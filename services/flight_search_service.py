@@ -11,10 +11,7 @@ import re
 from dotenv import load_dotenv
 import uvicorn
 import logging
-import sys
 
-# Add parent directory to path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logging_config import setup_logging
 from .real_flight_search import get_real_flights
 from .amadeus_sdk_flight_search import AmadeusSDKFlightSearch
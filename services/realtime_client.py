@@ -8,8 +8,6 @@ import websockets
 import logging
 from openai import OpenAI
 from .functions import REALTIME_FUNCTIONS
-import sys
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.session_logging import setup_session_logging, get_session_logger
 
 # Set up session logging
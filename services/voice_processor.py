@@ -9,8 +9,6 @@ import base64
 from .realtime_client import RealtimeClient, check_realtime_access
 from .functions import ALL_FUNCTIONS
 from .flight_search_service import FlightSearchServer
-import sys
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.session_logging import setup_session_logging
 
 logger = setup_session_logging('voice_processor')
@@ -355,142 +353,128 @@ class VoiceProcessor:
             # Step 1: Speech-to-Text (Whisper)
             logger.info(f"Transcribing audio (language: {language})")
             
-            # Create a temporary file for audio
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
-            
-            try:
-                # Transcribe with language hint
-                with open(temp_file_path, "rb") as audio_file:
-                    # Only pass language if it's a valid ISO-639-1 code
-                    lang_param = None
-                    if language != 'auto' and len(language) == 2:
-                        lang_param = language
-                    
-                    transcript = await self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file,
-                        language=lang_param,
-                        response_format="verbose_json"
+            # Only pass language if it's a valid ISO-639-1 code
+            lang_param = None
+            if language != 'auto' and len(language) == 2:
+                lang_param = language
+            
+            # Transcribe with language hint; upload straight from memory
+            transcript = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("audio.wav", audio_data),
+                language=lang_param,
+                response_format="verbose_json"
+            )
+            
+            text = transcript.text
+            detected_language = transcript.language if hasattr(transcript, 'language') else language
+            
+            logger.info(f"Transcribed: {text}")
+            
+            # Add to conversation history
+            self.conversation_history.append({
+                "role": "user",
+                "content": text
+            })
+            
+            # Build messages with history
+            messages = [
+                {
+                    "role": "system",
+                    "content": f"""You are a multilingual flight search assistant.
+                    Current language: {self.supported_languages.get(detected_language, detected_language)}.
+                    Always respond in the same language as the user.
+                    Help users find flights using the available functions.
+                    Remember the context from previous messages in the conversation."""
+                }
+            ]
+            
+            # Add conversation history (limited to last N exchanges)
+            messages.extend(self.conversation_history[-self.max_history:])
+            
+            # Step 2: Process with LLM (GPT-4 with functions)
+            response = await self.client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                messages=messages,
+                tools=ALL_FUNCTIONS,
+                tool_choice="auto"
+            )
+            
+            # Handle function calls if any
+            message = response.choices[0].message
+            
+            if message.tool_calls:
+                # Execute function calls
+                function_results = []
+                for tool_call in message.tool_calls:
+                    result = await self._execute_function(
+                        tool_call.function.name,
+                        json.loads(tool_call.function.arguments)
                     )
+                    function_results.append({
+                        "tool_call_id": tool_call.id,
+                        "output": json.dumps(result) if not isinstance(result, str) else result
+                    })
                 
-                text = transcript.text
-                detected_language = transcript.language if hasattr(transcript, 'language') else language
-                
-                logger.info(f"Transcribed: {text}")
-                
-                # Add to conversation history
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": text
-                })
-                
-                # Build messages with history
-                messages = [
-                    {
-                        "role": "system",
-                        "content": f"""You are a multilingual flight search assistant.
-                        Current language: {self.supported_languages.get(detected_language, detected_language)}.
-                        Always respond in the same language as the user.
-                        Help users find flights using the available functions.
-                        Remember the context from previous messages in the conversation."""
-                    }
-                ]
-                
-                # Add conversation history (limited to last N exchanges)
-                messages.extend(self.conversation_history[-self.max_history:])
-                
-                # Step 2: Process with LLM (GPT-4 with functions)
-                response = await self.client.chat.completions.create(
+                # Get final response with function results
+                final_response = await self.client.chat.completions.create(
                     model="gpt-4-turbo-preview",
-                    messages=messages,
-                    tools=ALL_FUNCTIONS,
-                    tool_choice="auto"
-                )
-                
-                # Handle function calls if any
-                message = response.choices[0].message
-                
-                if message.tool_calls:
-                    # Execute function calls
-                    function_results = []
-                    for tool_call in message.tool_calls:
-                        result = await self._execute_function(
-                            tool_call.function.name,
-                            json.loads(tool_call.function.arguments)
-                        )
-                        function_results.append({
-                            "tool_call_id": tool_call.id,
-                            "output": json.dumps(result) if not isinstance(result, str) else result
-                        })
-                    
-                    # Get final response with function results
-                    final_response = await self.client.chat.completions.create(
-                        model="gpt-4-turbo-preview",
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": f"""You are a multilingual flight search assistant.
-                                Current language: {self.supported_languages.get(detected_language, detected_language)}.
-                                Always respond in the same language as the user."""
-                            },
-                            {
-                                "role": "user",
-                                "content": text
-                            },
-                            message,
-                            *[{
-                                "role": "tool",
-                                "tool_call_id": result["tool_call_id"],
-                                "content": result["output"]
-                            } for result in function_results]
-                        ]
-                    )
-                    
-                    response_text = final_response.choices[0].message.content
-                else:
-                    response_text = message.content
-                
-                # Add assistant's response to history
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": response_text
-                })
-                
-                # Trim history if too long
-                if len(self.conversation_history) > self.max_history * 2:
-                    self.conversation_history = self.conversation_history[-(self.max_history * 2):]
-                
-                # Step 3: Text-to-Speech
-                logger.info(f"Generating speech for: {response_text[:100]}...")
-                
-                # Select voice based on language
-                voice = self._get_voice_for_language(detected_language)
-                
-                tts_response = await self.client.audio.speech.create(
-                    model="tts-1",
-                    voice=voice,
-                    input=response_text
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": f"""You are a multilingual flight search assistant.
+                            Current language: {self.supported_languages.get(detected_language, detected_language)}.
+                            Always respond in the same language as the user."""
+                        },
+                        {
+                            "role": "user",
+                            "content": text
+                        },
+                        message,
+                        *[{
+                            "role": "tool",
+                            "tool_call_id": result["tool_call_id"],
+                            "content": result["output"]
+                        } for result in function_results]
+                    ]
                 )
                 
-                audio_content = tts_response.content
-                
-                return {
-                    "type": "response_complete",
-                    "text": response_text,
-                    "audio": audio_content,
-                    "language": detected_language,
-                    "input_text": text
-                }
-                
-            finally:
-                # Clean up temp file
-                import os
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                
+                response_text = final_response.choices[0].message.content
+            else:
+                response_text = message.content
+            
+            # Add assistant's response to history
+            self.conversation_history.append({
+                "role": "assistant",
+                "content": response_text
+            })
+            
+            # Trim history if too long
+            if len(self.conversation_history) > self.max_history * 2:
+                self.conversation_history = self.conversation_history[-(self.max_history * 2):]
+            
+            # Step 3: Text-to-Speech
+            logger.info(f"Generating speech for: {response_text[:100]}...")
+            
+            # Select voice based on language
+            voice = self._get_voice_for_language(detected_language)
+            
+            tts_response = await self.client.audio.speech.create(
+                model="tts-1",
+                voice=voice,
+                input=response_text
+            )
+            
+            audio_content = tts_response.content
+            
+            return {
+                "type": "response_complete",
+                "text": response_text,
+                "audio": audio_content,
+                "language": detected_language,
+                "input_text": text
+            }
+            
         except Exception as e:
             logger.error(f"Standard pipeline error: {e}")
             return {
@@ -502,29 +486,17 @@ class VoiceProcessor:
     async def _detect_language(self, audio_data: bytes) -> str:
         """Detect language from audio using Whisper"""
         try:
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
-            
-            try:
-                with open(temp_file_path, "rb") as audio_file:
-                    result = await self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file,
-                        response_format="verbose_json"
-                    )
-                
-                detected = result.language if hasattr(result, 'language') else 'en'
-                # Whisper already returns ISO-639-1 codes, no conversion needed
-                logger.info(f"Detected language: {detected}")
-                return detected
-                
-            finally:
-                import os
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                    
+            result = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("audio.wav", audio_data),
+                response_format="verbose_json"
+            )
+            
+            detected = result.language if hasattr(result, 'language') else 'en'
+            # Whisper already returns ISO-639-1 codes, no conversion needed
+            logger.info(f"Detected language: {detected}")
+            return detected
+            
         except Exception as e:
             logger.error(f"Language detection error: {e}")
             return 'en'
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Behavior tests for the flight agent's price parsing, audio frame buffer and
+search result caches
+Tests without requiring the API server or LiveKit to be running
+"""
+
+import asyncio
+import math
+import unittest
+import sys
+from unittest.mock import Mock, patch, AsyncMock
+from pathlib import Path
+
+import numpy as np
+
+# Add parent and agent directories to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "polyglot-flight-agent"))
+
+import agent
+from audio_utils import AudioFrameBuffer
+from services.amadeus_flight_search import AmadeusFlightSearch, _iso_minutes
+
+
+class TestParsePrices(unittest.TestCase):
+    """Test parse_prices and the flight ordering built on it"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        """Clean up"""
+        self.loop.close()
+
+    def test_currency_strings(self):
+        """Currency symbols and thousands separators are stripped"""
+        prices = agent.parse_prices([
+            {"price": "$1,234.50"},
+            {"price": "$99"},
+            {"price": " 450.00 "},
+            {"price": 320},
+        ])
+        np.testing.assert_array_equal(prices, [1234.5, 99.0, 450.0, 320.0])
+        print("✅ Currency strings parsed")
+
+    def test_unavailable_prices_are_inf(self):
+        """Unavailable markers (any case/padding) and missing prices sort last"""
+        prices = agent.parse_prices([
+            {"price": "Check website"},
+            {"price": " N/A "},
+            {"price": "not available"},
+            {"price": ""},
+            {},
+            {"price": "$200"},
+        ])
+        self.assertTrue(np.isinf(prices[:5]).all())
+        self.assertEqual(prices[5], 200.0)
+        print("✅ Unavailable prices parsed as inf")
+
+    def test_free_text_falls_back_per_element(self):
+        """One free-text price doesn't stop the others from parsing"""
+        prices = agent.parse_prices([
+            {"price": "$300"},
+            {"price": "USD 450"},
+            {"price": "1,000"},
+        ])
+        self.assertEqual(prices[0], 300.0)
+        self.assertTrue(math.isinf(prices[1]))
+        self.assertEqual(prices[2], 1000.0)
+        print("✅ Free-text price falls back to inf")
+
+    def test_empty_list(self):
+        """No flights gives an empty float array"""
+        prices = agent.parse_prices([])
+        self.assertEqual(prices.shape, (0,))
+        print("✅ Empty flight list parsed")
+
+    def test_layover_ties_keep_api_order(self):
+        """Connecting flights sort by price; tied fares stay in API order"""
+        flights = [
+            {"airline": f"NoPrice{i}", "price": "Check website", "stops": 1, "duration": "8h"}
+            for i in range(8)
+        ]
+        flights.insert(3, {"airline": "CheapB", "price": "$300", "stops": 1, "duration": "7h"})
+        flights.insert(5, {"airline": "CheapA", "price": "$250", "stops": 1, "duration": "9h"})
+        flights.append({"airline": "CheapC", "price": "$300", "stops": 2, "duration": "10h"})
+        flights.append({"airline": "Direct", "price": "$500", "stops": 0, "duration": "6h"})
+
+        with patch.object(agent, "FlightAPIClient"), \
+             patch.object(agent, "cached_flight_search", AsyncMock(return_value={"flights": flights})):
+            result = self.loop.run_until_complete(
+                agent.search_flights(Mock(), "New York", "London", "2025-07-07")
+            )
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["connecting_count"], 11)
+        layover = result["message"].split("Flights with layover:")[1]
+        airlines = [line.split(",")[0].removeprefix("- Airline: ")
+                    for line in layover.strip().splitlines() if line.startswith("- Airline:")]
+        # Cheapest first, the $300 tie in API order, then the 7 unpriced that fit
+        self.assertEqual(
+            airlines,
+            ["CheapA", "CheapB", "CheapC"] + [f"NoPrice{i}" for i in range(7)]
+        )
+        self.assertIn("price not available", layover)
+        print("✅ Tied prices keep API order")
+
+
+class TestAudioFrameBuffer(unittest.TestCase):
+    """Test the ring buffer behind the agent's audio output"""
+
+    def _samples(self, frames):
+        return np.concatenate([np.frombuffer(bytes(f.data), dtype=np.int16) for f in frames])
+
+    def test_odd_byte_tail_across_chunks(self):
+        """A sample split across two chunks is reassembled exactly"""
+        samples = np.arange(-120, 120, dtype=np.int16)  # One 10ms frame at 24kHz
+        data = samples.tobytes()
+        buffer = AudioFrameBuffer(sample_rate=24000, frame_duration_ms=10)
+
+        frames = buffer.add_data(data[:101])
+        self.assertEqual(frames, [])
+        self.assertEqual(len(buffer), 100)
+        frames = buffer.add_data(data[101:333])
+        frames += buffer.add_data(data[333:])
+
+        self.assertEqual(len(frames), 1)
+        np.testing.assert_array_equal(self._samples(frames), samples)
+        self.assertEqual(len(buffer), 0)
+        print("✅ Odd-byte tail reassembled")
+
+    def test_fixed_frame_size_by_default(self):
+        """Without a maximum every frame is frame_duration_ms long"""
+        buffer = AudioFrameBuffer(sample_rate=48000, frame_duration_ms=10)
+        frames = buffer.add_data(np.ones(480 * 5, dtype=np.int16).tobytes())
+        self.assertEqual([f.samples_per_channel for f in frames], [480] * 5)
+        print("✅ Fixed frame sizes")
+
+    def test_progressive_frame_sizes(self):
+        """Frames double from frame_duration_ms up to max_frame_duration_ms"""
+        buffer = AudioFrameBuffer(sample_rate=48000, frame_duration_ms=10, max_frame_duration_ms=40)
+        samples = (np.arange(48000, dtype=np.int32) % 30000).astype(np.int16)
+        frames = []
+        # Feed in uneven chunks so frames are cut across chunk boundaries
+        for start in range(0, len(samples), 700):
+            frames += buffer.add_data(samples[start:start + 700].tobytes())
+
+        sizes = [f.samples_per_channel for f in frames]
+        self.assertEqual(sizes[:4], [480, 960, 1920, 1920])
+        self.assertTrue(all(size == 1920 for size in sizes[2:]))
+        frames += buffer.flush()
+        np.testing.assert_array_equal(self._samples(frames)[:len(samples)], samples)
+        print("✅ Progressive frame sizes")
+
+    def test_flush_pads_to_base_frame(self):
+        """Flush zero-pads the remainder to a whole number of base frames"""
+        buffer = AudioFrameBuffer(sample_rate=48000, frame_duration_ms=20)
+        buffer.add_data(np.full(500, 7, dtype=np.int16).tobytes())
+        frames = buffer.add_data(b"")
+        self.assertEqual(frames, [])
+
+        frames = buffer.flush()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0].samples_per_channel, 960)
+        samples = self._samples(frames)
+        self.assertTrue((samples[:500] == 7).all())
+        self.assertTrue((samples[500:] == 0).all())
+        self.assertEqual(buffer.flush(), [])
+        print("✅ Flush pads to base frame")
+
+    def test_clear_resets_progression(self):
+        """After clear the next utterance starts with a short frame again"""
+        buffer = AudioFrameBuffer(sample_rate=48000, frame_duration_ms=10, max_frame_duration_ms=40)
+        buffer.add_data(np.zeros(480 + 960 + 100, dtype=np.int16).tobytes() + b"\x01")
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+
+        frames = buffer.add_data(np.ones(480, dtype=np.int16).tobytes())
+        self.assertEqual([f.samples_per_channel for f in frames], [480])
+        np.testing.assert_array_equal(self._samples(frames), np.ones(480, dtype=np.int16))
+        print("✅ Clear resets frame progression")
+
+    def test_ring_grows_when_not_drained(self):
+        """A chunk larger than the ring is buffered without losing samples"""
+        buffer = AudioFrameBuffer(sample_rate=8000, frame_duration_ms=10)
+        samples = (np.arange(80 * 40, dtype=np.int32) % 1000).astype(np.int16)
+        frames = buffer.add_data(samples.tobytes())
+        self.assertEqual(len(frames), 40)
+        np.testing.assert_array_equal(self._samples(frames), samples)
+        print("✅ Ring grows for large chunks")
+
+
+class TestFlightSearchCache(unittest.TestCase):
+    """Test the agent's flight search cache"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        agent._FLIGHT_CACHE.clear()
+        agent._FLIGHT_SEARCHES_IN_FLIGHT.clear()
+
+    def tearDown(self):
+        """Clean up"""
+        agent._FLIGHT_CACHE.clear()
+        agent._FLIGHT_SEARCHES_IN_FLIGHT.clear()
+        self.loop.close()
+
+    def _client(self, result=None, delay=0.0):
+        client = Mock()
+
+        async def search_flights(*args):
+            await asyncio.sleep(delay)
+            return result if result is not None else {"flights": [{"airline": "AA"}]}
+
+        client.search_flights = AsyncMock(side_effect=search_flights)
+        return client
+
+    def test_concurrent_identical_searches_share_one_call(self):
+        """Identical queries in flight at once make a single upstream call"""
+        client = self._client(delay=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                agent.cached_flight_search(client, "New York", "London", "2025-07-07"),
+                agent.cached_flight_search(client, " new york ", "LONDON", "2025-07-07"),
+                agent.cached_flight_search(client, "New York", "London", "2025-07-07"),
+            )
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(client.search_flights.await_count, 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(agent._FLIGHT_SEARCHES_IN_FLIGHT, {})
+
+        # Served from the cache afterwards
+        self.loop.run_until_complete(
+            agent.cached_flight_search(client, "New York", "London", "2025-07-07")
+        )
+        self.assertEqual(client.search_flights.await_count, 1)
+        print("✅ Concurrent searches share one call")
+
+    def test_cancelled_caller_does_not_cancel_search(self):
+        """Cancelling one waiter leaves the shared search running for the rest"""
+        client = self._client(delay=0.02)
+
+        async def run():
+            first = asyncio.ensure_future(
+                agent.cached_flight_search(client, "JFK", "LHR", "2025-07-07"))
+            second = asyncio.ensure_future(
+                agent.cached_flight_search(client, "JFK", "LHR", "2025-07-07"))
+            await asyncio.sleep(0.005)
+            first.cancel()
+            return await second
+
+        result = self.loop.run_until_complete(run())
+        self.assertEqual(result, {"flights": [{"airline": "AA"}]})
+        self.assertEqual(client.search_flights.await_count, 1)
+        print("✅ Cancelled caller leaves the search running")
+
+    def test_errors_are_not_cached(self):
+        """Error responses are retried on the next search"""
+        client = self._client(result={"error": "timeout"})
+        for _ in range(2):
+            result = self.loop.run_until_complete(
+                agent.cached_flight_search(client, "JFK", "LHR", "2025-07-07"))
+            self.assertIn("error", result)
+        self.assertEqual(client.search_flights.await_count, 2)
+        print("✅ Errors are not cached")
+
+    def test_expired_entries_are_evicted(self):
+        """Entries older than the TTL are dropped and searched again"""
+        client = self._client()
+        self.loop.run_until_complete(
+            agent.cached_flight_search(client, "JFK", "LHR", "2025-07-07"))
+        key, (cached_at, results) = next(iter(agent._FLIGHT_CACHE.items()))
+        agent._FLIGHT_CACHE[key] = (cached_at - agent._FLIGHT_CACHE_TTL - 1, results)
+
+        self.loop.run_until_complete(
+            agent.cached_flight_search(client, "JFK", "LHR", "2025-07-07"))
+        self.assertEqual(client.search_flights.await_count, 2)
+        self.assertEqual(len(agent._FLIGHT_CACHE), 1)
+        print("✅ Expired entries are evicted")
+
+
+class TestAmadeusHelpers(unittest.TestCase):
+    """Test Amadeus timestamp parsing and the result cache"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.amadeus = AmadeusFlightSearch()
+        self.amadeus._get_access_token = AsyncMock(return_value="token")
+        self.amadeus.http_client.get = AsyncMock(return_value=Mock(status_code=200, content=b"{}"))
+        self.amadeus._format_amadeus_results = Mock(
+            side_effect=lambda data: [{"airline_code": "AA", "stops": 0, "price": 450.0}]
+        )
+
+    def tearDown(self):
+        """Clean up"""
+        self.loop.run_until_complete(self.amadeus.close())
+        self.loop.close()
+
+    def _search(self, origin="jfk"):
+        return self.loop.run_until_complete(
+            self.amadeus.search_flights(origin=origin, destination="lax", departure_date="2025-07-07")
+        )
+
+    def test_iso_minutes(self):
+        """Timestamps convert to minutes, with or without seconds"""
+        self.assertEqual(
+            _iso_minutes("2025-07-07T10:30:00") - _iso_minutes("2025-07-07T08:15"), 135
+        )
+        self.assertEqual(
+            _iso_minutes("2025-03-01T00:00:00") - _iso_minutes("2025-02-28T23:00:00"), 60
+        )
+        print("✅ ISO timestamps converted to minutes")
+
+    def test_layover_across_midnight(self):
+        """Layover durations count across day boundaries"""
+        self.assertEqual(
+            self.amadeus._calculate_layover_duration("2025-07-07T22:40:00", "2025-07-08T01:05:00"),
+            "2h 25m"
+        )
+        self.assertEqual(
+            self.amadeus._calculate_layover_duration("2025-07-07T10:00:00", "2025-07-07T10:45:00"),
+            "45m"
+        )
+        self.assertEqual(self.amadeus._calculate_layover_duration("", "2025-07-07T10:45:00"), "")
+        print("✅ Layover durations across midnight")
+
+    def test_cache_hit_returns_copy(self):
+        """Repeat searches reuse the cache but never share the cached dicts"""
+        first = self._search()
+        first[0]["price"] = 1.0
+        second = self._search(origin="JFK")
+
+        self.assertEqual(self.amadeus.http_client.get.await_count, 1)
+        self.assertEqual(second[0]["price"], 450.0)
+        second[0]["price"] = 2.0
+        self.assertEqual(self._search()[0]["price"], 450.0)
+        print("✅ Cache hits return copies")
+
+    def test_cache_expires_after_ttl(self):
+        """Entries older than the TTL are fetched again"""
+        self._search()
+        key, (cached_at, results) = next(iter(self.amadeus._cache.items()))
+        self.amadeus._cache[key] = (cached_at - 3600, results)
+        self._search()
+        self.assertEqual(self.amadeus.http_client.get.await_count, 2)
+        print("✅ Cache expires after TTL")
+
+
+def run_tests():
+    """Run all tests"""
+    print("🧪 Running hot path helper tests...\n")
+
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for case in (TestParsePrices, TestAudioFrameBuffer, TestFlightSearchCache, TestAmadeusHelpers):
+        suite.addTests(loader.loadTestsFromTestCase(case))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    if result.wasSuccessful():
+        print("\n✅ All hot path helper tests passed!")
+    else:
+        print(f"\n❌ {len(result.failures)} tests failed, {len(result.errors)} errors")
+
+    return result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -36,54 +36,60 @@ async def test_real_flights():
     # Test date (2 weeks from now for better availability)
     test_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
     
-    for route in test_routes:
-        print(f"\n✈️  Testing: {route['name']}")
-        print(f"   Route: {route['origin']} → {route['destination']}")
-        print(f"   Date: {test_date}")
-        
-        try:
-            # Search for flights
-            results = await amadeus.search_flights(
+    # Run all route searches concurrently, then report them in order
+    all_results = await asyncio.gather(
+        *(
+            amadeus.search_flights(
                 origin=route['origin'],
                 destination=route['destination'],
                 departure_date=test_date,
                 adults=1,
                 travel_class="ECONOMY"
             )
+            for route in test_routes
+        ),
+        return_exceptions=True
+    )
+    
+    for route, results in zip(test_routes, all_results):
+        print(f"\n✈️  Testing: {route['name']}")
+        print(f"   Route: {route['origin']} → {route['destination']}")
+        print(f"   Date: {test_date}")
+        
+        if isinstance(results, Exception):
+            print(f"   ❌ Error: {results}")
+            continue
+        
+        if results:
+            print(f"   ✅ Found {len(results)} flights")
             
-            if results:
-                print(f"   ✅ Found {len(results)} flights")
-                
-                # Check for direct flights
-                direct_flights = [f for f in results if f.get("stops", 0) == 0]
-                print(f"   Direct flights: {len(direct_flights)}")
-                
-                # Show airlines
-                airlines = set(f["airline_code"] for f in results)
-                print(f"   Airlines: {', '.join(sorted(airlines))}")
-                
-                # Check for specific airlines
-                aa_flights = [f for f in results if f.get("airline_code") == "AA"]
-                if aa_flights:
-                    print(f"   🎯 American Airlines flights: {len(aa_flights)}")
-                    aa_direct = [f for f in aa_flights if f.get("stops", 0) == 0]
-                    if aa_direct:
-                        print(f"   🎯 American Airlines DIRECT: {len(aa_direct)}")
-                
-                # Show first direct flight if available
-                if direct_flights:
-                    flight = direct_flights[0]
-                    print(f"\n   First direct flight:")
-                    print(f"   {flight['airline']} ({flight['airline_code']}) - {flight['flight_number']}")
-                    print(f"   Departure: {flight['departure_time']} from {flight['departure_airport']}")
-                    print(f"   Arrival: {flight['arrival_time']} at {flight['arrival_airport']}")
-                    print(f"   Duration: {flight['duration']}")
-                    print(f"   Price: {flight['price_formatted']}")
-            else:
-                print(f"   ❌ No flights found")
-                
-        except Exception as e:
-            print(f"   ❌ Error: {e}")
+            # Check for direct flights
+            direct_flights = [f for f in results if f.get("stops", 0) == 0]
+            print(f"   Direct flights: {len(direct_flights)}")
+            
+            # Show airlines
+            airlines = set(f["airline_code"] for f in results)
+            print(f"   Airlines: {', '.join(sorted(airlines))}")
+            
+            # Check for specific airlines
+            aa_flights = [f for f in results if f.get("airline_code") == "AA"]
+            if aa_flights:
+                print(f"   🎯 American Airlines flights: {len(aa_flights)}")
+                aa_direct = [f for f in aa_flights if f.get("stops", 0) == 0]
+                if aa_direct:
+                    print(f"   🎯 American Airlines DIRECT: {len(aa_direct)}")
+            
+            # Show first direct flight if available
+            if direct_flights:
+                flight = direct_flights[0]
+                print(f"\n   First direct flight:")
+                print(f"   {flight['airline']} ({flight['airline_code']}) - {flight['flight_number']}")
+                print(f"   Departure: {flight['departure_time']} from {flight['departure_airport']}")
+                print(f"   Arrival: {flight['arrival_time']} at {flight['arrival_airport']}")
+                print(f"   Duration: {flight['duration']}")
+                print(f"   Price: {flight['price_formatted']}")
+        else:
+            print(f"   ❌ No flights found")
     
     # Test specific American Airlines route on specific date
     print("\n" + "="*60)